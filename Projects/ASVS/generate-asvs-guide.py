@@ -1,60 +1,99 @@
 
 import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
 from dotenv import load_dotenv
 import json
-import openai
 import os
 import random
 import re
 import requests
 import subprocess
 import requests
-from typing import Dict, List
-from varname import nameof
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from backends import ModelBackend, get_backend
+from batch_client import AsyncBatcher, BatchClient
+from chat_client import ChatClient
+from completion_cache import CompletionCache
+from guide_manifest import GuideManifest, get_hash
+from atomic_writer import AtomicWriter, write_atomic
+from http_cache import HttpCache
+from telemetry import Telemetry
+from validators import ResponseValidator, get_validators, validate
 
 with open("config.json") as f:
     config = json.load(f)
 
 
-def is_valid_model(id: str) -> bool:
-    response = openai.Model.list()
-    return response is not None and id in [model['id'] for model in response['data']] # type: ignore
-
-def validate_openai_config(model_id: str) -> None:
-    if openai.organization is None:
-        print(f"Error: {nameof(openai)}.{nameof(openai.organization)} is not set.")
+def validate_config(backend: ModelBackend, model_id: str) -> None:
+    for error in backend.get_config_errors():
+        print(f"Error: {error}")
         exit(1)
-    if openai.api_key is None:
-        print(f"Error: {nameof(openai)}.{nameof(openai.api_key)} is not set.")
-        exit(1)
-    if not is_valid_model(model_id):
+    if not backend.is_valid_model(model_id):
         print(f"Error: '{model_id}' is not a valid model.")
         exit(1)
+    try:
+        get_validators(config)
+        if config.get("batch", False):
+            BatchClient.from_config(config, backend)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
 
 def get_system_commands(system_name: str, system_commands: list[str]) -> list[dict[str, str]]:
     system_commands = [cmd.format(system_name=system_name) for cmd in system_commands]
     return [{"role": "system", "content": "\n".join(system_commands)}]
 
-def fetch_asvs_requirements():
-    release_url = "https://api.github.com/repos/OWASP/ASVS/releases/latest"
-    response = requests.get(release_url)
-    if response.ok:
-        assets = response.json()["assets"]
-        # default to language `en` since this is what is used in releases
-        regex = r"OWASP\.Application\.Security\.Verification\.Standard\.[\d]{1,2}\.[\d]{1,3}\.[\d]{1,4}-en\.json"
+def load_requirements(http: HttpCache, url: str, path: str):
+    """
+    Returns the requirements in the release asset at `url`.
+
+    Release assets don't change, so the requirements are only downloaded once & are
+    then stored as compact JSON at `path`.
+    """
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    requirements = json.loads(http.fetch(url))
+    write_atomic(path, json.dumps(requirements, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    return requirements
+
+def get_release_url(release_url: str, version: Optional[str] = None) -> str:
+    """
+    Returns the GitHub API URL of the release tagged `version` (e.g. `v4.0.3_release`), or `release_url` (the latest release) if it's not set.
+    """
+    if not version or version == "latest":
+        return release_url
+    return f"{release_url.rsplit('/', 1)[0]}/tags/{version}"
+
+def fetch_asvs_requirements(http: HttpCache, requirements_dir: str, release_url: str, release_max_age: float = 3600,
+                            version: Optional[str] = None, language: str = "en"):
+    if not os.path.exists(requirements_dir):
+        os.makedirs(requirements_dir)
+
+    try:
+        assets = http.get_json(get_release_url(release_url, version), release_max_age)["assets"]
+        regex = rf"OWASP\.Application\.Security\.Verification\.Standard\.[\d]{{1,2}}\.[\d]{{1,3}}\.[\d]{{1,4}}-{re.escape(language)}\.json"
         for asset in assets:
             if re.match(regex, asset["name"]):
-                download_url = asset["browser_download_url"]
-                response = requests.get(download_url)
-                if response.ok:
-                    return response.json()
-                else:
-                    break
-
-    # Fall back to known release (latest at time of writing) if API requests fail
-    url = "https://github.com/OWASP/ASVS/releases/download/v4.0.3_release/OWASP.Application.Security.Verification.Standard.4.0.3-en.json"
-    response = requests.get(url)
-    return response.json()
+                return load_requirements(http, asset["browser_download_url"], os.path.join(requirements_dir, asset["name"]))
+    except requests.RequestException as e:
+        print(f"Error fetching the ASVS release: {e}")
+
+    # Fall back to the release's download URL (or the latest release at time of writing) if API requests fail
+    tag = version if version and version != "latest" else "v4.0.3_release"
+    number = re.search(r"\d+\.\d+\.\d+", tag)
+    if number is None:
+        raise ValueError(f"Couldn't find the requirements for ASVS release '{tag}' in language '{language}'")
+    url = f"https://github.com/OWASP/ASVS/releases/download/{tag}/OWASP.Application.Security.Verification.Standard.{number.group()}-{language}.json"
+    return load_requirements(http, url, os.path.join(requirements_dir, os.path.basename(url)))
 
 def get_logged_in_username():
     try:
@@ -111,251 +150,665 @@ def create_repo(output_dir, username, repo_name, err_not_empty=True):
         raise ValueError("The cloned repository directory is not empty")
 
 
-def create_directory_structure_and_files(output_dir, requirements, docs_dir):
+INVALID_RESPONSE = "OPENAI_ERROR_INVALID_RESPONSE"
+
+# bump when the prompts, or the Markdown they're written into, change so the next run regenerates every file
+PROMPT_VERSION = 4
+
+# what examples are written for when they can't be technology agnostic, unless a guide sets its own `tech_stack`
+DEFAULT_TECH_STACK = "React frontend, C# RESTful WebAPI backend, either CosmosDB or MS SQL data storage, and a Cloudflare WAF"
+
+@dataclass
+class GuideContext:
+    """Shared state for a single guide generation run."""
+    name: str
+    version: str
+    label: str
+    tech_stack: str
+    model_id: str
+    client: ChatClient
+    limiter: asyncio.Semaphore
+    executor: ThreadPoolExecutor
+    writer: AtomicWriter
+    cache: Optional[CompletionCache] = None
+    batcher: Optional[AsyncBatcher] = None
+    manifest: Optional[GuideManifest] = None
+    guide_hash: str = ""
+    nodes: Set[str] = field(default_factory=set)
+    # checks on every response, which is asked for again (with adjusted parameters) up to `max_regenerations` times until it passes
+    validators: List[ResponseValidator] = field(default_factory=list)
+    max_regenerations: int = 2
+    params: Dict[str, Any] = field(default_factory=dict)
+    regenerated: int = 0
+    invalid: int = 0
+    # requests in flight, shared by every guide in the run so identical requests are only sent once
+    pending: Dict[str, "asyncio.Future[str]"] = field(default_factory=dict)
+
+def get_completion(client: ChatClient, model_id: str, messages: List[Dict[str, str]], tags: Optional[Dict[str, str]] = None,
+                   params: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[str]]:
+    response = client.create(
+                    model=model_id,
+                    messages=messages,
+                    tags=tags,
+                    **(params or {})
+                )
+
+    choice = response['choices'][0] # type: ignore
+    return choice['message']['content'], choice.get('finish_reason')
+
+def describe(tags: Dict[str, str]) -> str:
+    return f"{tags.get('kind')} {tags.get('part')} of {tags.get('requirement') or tags.get('section') or tags.get('chapter')} ({tags.get('guide')})"
+
+async def request(ctx: GuideContext, messages: List[Dict[str, str]], tags: Dict[str, str], params: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    if ctx.batcher is not None:
+        started = time.monotonic()
+        response = await ctx.batcher.submit(ctx.model_id, messages, **params)
+        telemetry = ctx.client.telemetry
+        if telemetry is not None:
+            telemetry.record(ctx.model_id, "batch", time.monotonic() - started, usage=response.get("usage"), tags=tags)
+        choice = response['choices'][0]
+        return choice['message']['content'], choice.get('finish_reason')
+
+    async with ctx.limiter:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(ctx.executor, get_completion, ctx.client, ctx.model_id, messages, tags, params)
+
+async def complete(ctx: GuideContext, messages: List[Dict[str, str]], tags: Dict[str, str], params: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """
+    Returns the response to `messages`, waiting for an identical request that's already in flight (e.g. for another variant of the guide) if there is one.
+    """
+    key = get_hash(ctx.model_id, messages, params)
+    pending = ctx.pending.get(key)
+    shared = pending is not None
+    if pending is None:
+        pending = ctx.pending[key] = asyncio.ensure_future(request(ctx, messages, tags, params))
+        # only requests in flight are shared, so a response that's asked for again (e.g. after failing validation) is a new request
+        pending.add_done_callback(lambda future: ctx.pending.pop(key, None) if ctx.pending.get(key) is future else None)
+
+    started = time.monotonic()
+    # shielded so one caller being cancelled doesn't cancel the request for the others
+    response = await asyncio.shield(pending)
+    if shared and ctx.client.telemetry is not None:
+        ctx.client.telemetry.record(ctx.model_id, "shared", time.monotonic() - started, tags=tags)
+    return response
+
+async def ask(ctx: GuideContext, messages: List[Dict[str, str]], prompt: str, tags: Optional[Dict[str, str]] = None,
+              stored: Optional[str] = None) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Sends `prompt` as the next user turn after `messages`.
+
+    A `stored` response (e.g. from the manifest) & responses already in the context's cache
+    are returned without a request, and a request that's identical to one already in flight
+    (e.g. for another variant of the guide) waits for its response. Otherwise, in batch mode the request is added to the context's next
+    batch, or else it's run on the context's worker pool once a slot is free on the
+    context's limiter, so at most `max_concurrent_requests` calls are in flight.
+
+    Each response is checked by the context's validators, and if it fails any of them it's
+    asked for again, with the prompt & parameters adjusted by the failed validators, up to
+    `max_regenerations` times; only responses that pass are cached.
+
+    Args:
+        ctx (GuideContext): The current generation run.
+        messages (List[Dict[str, str]]): The conversation prefix the prompt depends on; not modified, and sent
+                                         verbatim ahead of the prompt so sibling requests share a cacheable prefix.
+        prompt (str): The user prompt to send.
+        tags (Dict[str, str]): What the prompt is for (e.g. its kind, part, chapter, section & requirement), for telemetry & validation [optional].
+        stored (str): The response to the same prompt, generated from the same inputs by a previous run (or for a previous release) [optional].
+
+    Returns:
+        Tuple[str, List[Dict[str, str]]]: The response content (or `INVALID_RESPONSE` if it never passed validation),
+                                          and the prefix extended with the prompt & response.
+    """
+    tags = {"guide": ctx.label, **(tags or {})}
+    validators = [validator for validator in ctx.validators if validator.applies(tags)]
+    telemetry = ctx.client.telemetry
+    params = dict(ctx.params)
+
+    original_messages = messages + [{"role": "user", "content": prompt}]
+
+    # stored responses are checked too, in case the validators have changed since
+    if stored is not None and not validate(validators, stored):
+        return stored, original_messages + [{"role": "assistant", "content": stored}]
+
+    for attempt in range(ctx.max_regenerations + 1):
+        request_messages = messages + [{"role": "user", "content": prompt}]
+        content = ctx.cache.get(ctx.model_id, request_messages) if ctx.cache is not None else None
+
+        # responses cached before validation was added (or with other validators) are checked too
+        if content is not None and not validate(validators, content):
+            if telemetry is not None:
+                telemetry.record(ctx.model_id, "cache", 0.0, tags=tags)
+            break
 
-    default_tech_stack = "React frontend, C# RESTful WebAPI backend, either CosmosDB or MS SQL data storage, and a Cloudflare WAF"
-    system_commands = config.get("system_commands")
-    doc_messages = get_system_commands("ASVS Bot", system_commands)
-    docs_dir = os.path.join(output_dir, docs_dir)
+        content, finish_reason = await complete(ctx, request_messages, tags, params)
+        failed = validate(validators, content, finish_reason)
+        if not failed:
+            if ctx.cache is not None:
+                ctx.cache.put(ctx.model_id, request_messages, content)
+                # so the next run finds it without first asking with the original prompt again
+                if attempt > 0:
+                    ctx.cache.put(ctx.model_id, original_messages, content)
+            break
 
-    if not os.path.exists(docs_dir):
-        os.makedirs(docs_dir)
+        problems = ", ".join(validator.name for validator in failed)
+        adjusted_prompt, adjusted_params = prompt, params
+        for validator in failed:
+            adjusted_prompt, adjusted_params = validator.adjust(adjusted_prompt, adjusted_params)
+
+        # asking again with nothing changed (e.g. the note's already in the prompt) isn't worth a request
+        if attempt == ctx.max_regenerations or (adjusted_prompt, adjusted_params) == (prompt, params):
+            print(f"ERROR: {describe(tags)} failed validation ({problems}) after {attempt} regenerations: {content[:200]}")
+            ctx.invalid += 1
+            return INVALID_RESPONSE, request_messages + [{"role": "assistant", "content": content}]
+
+        print(f"Regenerating {describe(tags)} ({problems}), {attempt + 1}/{ctx.max_regenerations}")
+        ctx.regenerated += 1
+        prompt, params = adjusted_prompt, adjusted_params
+
+    return content, request_messages + [{"role": "assistant", "content": content}]
+
+def get_section_name(chapter_shortCode: str, section) -> str:
+    return f"{chapter_shortCode}.{section['Shortcode'][1:]} {section['Name']}"
+
+def get_node_key(ctx: GuideContext, shortcode: str) -> str:
+    # unlike the codes in the guide, the keys don't include the version, so a guide for the next release can reuse each node's content
+    return f"{ctx.name}-{shortcode}"
+
+def get_requirement_hash(section_hash: str, requirement) -> str:
+    return get_hash(section_hash, requirement['Shortcode'], requirement['Description'], requirement['L1'], requirement['L2'], requirement['L3'])
+
+def get_section_hash(chapter_hash: str, section) -> str:
+    return get_hash(chapter_hash, section['Shortcode'], section['Name'])
+
+def get_section_file_hash(version: str, section_hash: str, section) -> str:
+    # the file includes the version in its codes, so it's rewritten for a new release even if none of its content has changed
+    return get_hash(section_hash, version, [get_requirement_hash(section_hash, requirement) for requirement in section["Items"]])
+
+def get_stored(ctx: GuideContext, key: str) -> Dict[str, Any]:
+    """
+    Returns what the manifest recorded for the node `key`, including the content of each part of it that was valid.
+    """
+    entry = ctx.manifest.get(key) if ctx.manifest is not None else None
+    return entry or {}
+
+def get_valid_parts(**parts: str) -> Dict[str, str]:
+    return {name: content for name, content in parts.items() if content != INVALID_RESPONSE}
+
+def get_requirement_level(requirement) -> Tuple[str, str]:
+    if requirement['L3']['Required']:
+        return "3", requirement['L3']['Requirement']
+    elif requirement['L2']['Required']:
+        return "2", requirement['L2']['Requirement']
+    elif requirement['L1']['Required']:
+        return "1", requirement['L1']['Requirement']
+    else:
+        return "0", "[optional depending on context]"
+
+async def generate_requirement(ctx: GuideContext, section_messages, section_intro, chapter_name, section_name, requirement, position, stored=None):
+    requirement_index, requirement_count, chapter_index, chapter_count, section_index, section_count = position
+
+    requirement_id = requirement['Shortcode']
+    requirement_code = f"{ctx.name}V{ctx.version}-{requirement_id[1:]}"
+    requirement_description = requirement['Description']
+    requirement_level, requirements_description = get_requirement_level(requirement)
+
+    print(f"Working on Requirement {requirement_index}/{requirement_count}: {requirement_id} (Chapter: {chapter_index}/{chapter_count} Section: {section_index}/{section_count})")
+
+    # the instructions are the same for every requirement, so they go before the requirement's details
+    # to extend the prefix shared by sibling requests (which the provider can serve from its prompt cache)
+    request_steps = "Produce a step-by-step guide to test the OWASP ASVS requirement below."
+    request_steps += "\nIf relevant, assume a modern web application and infer that it should be using modern best practice."
+    request_steps += f"\nIf you can, make the example technology agnostic; if you cannot, then assume a {ctx.tech_stack}."
+    request_steps += "\nContent is to be included directly into a markdown file (under a third-level heading for this requirement)"
+    request_steps += "; so do not include additional description of what you're producing, or platitudes etc. in your response."
+    request_steps += "\nBreak down the content as needed using appropriate markdown headers etc."
+
+    request_steps += f"\n\nRequirement: {requirement_id}."
+    request_steps += f"\nThe Requirement is from Chapter: \"{chapter_name}\", Section: \"{section_name}\"."
+    request_steps += f"\nRequirement details: \"{requirement_description}\"."
+    request_steps += f"\nApplication Security Verification (ASV) Level: {requirement_level}."
+
+    if requirements_description:
+        request_steps += f" ASV Requirement: {requirements_description}."
+
+    print(f"Chapter {chapter_index}/{chapter_count} Section {section_index}/{section_count} Req {requirement_index}/{requirement_count}: Generating Steps")
+    # a response that never passes validation is returned as `INVALID_RESPONSE`, so it's left out & tried again on the next run
+    requirement_steps, _ = await ask(ctx, section_messages, request_steps,
+                                     {"kind": "requirement", "part": "steps", "chapter": chapter_name, "section": section_name,
+                                      "requirement": requirement_id}, stored)
+
+    return {
+        "id": requirement_id,
+        "code": requirement_code,
+        "description": requirement_description,
+        "level": requirement_level,
+        "level_description": requirements_description,
+        "steps": requirement_steps,
+    }
+
+async def generate_section(ctx: GuideContext, chapter_dir, chapter_messages, chapter_name, chapter_shortCode, section, section_hash, position):
+    section_index, section_count, chapter_index, chapter_count = position
+    requirement_count = len(section["Items"])
+
+    section_key = get_node_key(ctx, section['Shortcode'])
+    section_code = f"{ctx.name}V{ctx.version}-{section['Shortcode'][1:]}"
+    section_name = get_section_name(chapter_shortCode, section)
+    section_file_name = section_name.replace(" ", "_")
 
-    name = requirements["ShortName"]
-    version = requirements["Version"]
-    out_dir = os.path.join(docs_dir, f"{name}_{version}")
+    print(f"Working on Section: {section_code} ({section_index}/{section_count}) - {section_name}.")
 
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
+    # the parts generated from the same inputs by a previous run (or for a previous release) are reused, so only
+    # the requirements that have changed are asked for
+    stored = get_stored(ctx, section_key)
+    stored_parts = stored.get("parts", {}) if stored.get("parts_hash") == section_hash else {}
+    requirement_hashes = {requirement['Shortcode']: get_requirement_hash(section_hash, requirement) for requirement in section["Items"]}
+    stored_steps = {requirement_id: entry["steps"] for requirement_id, entry in stored.get("requirements", {}).items()
+                    if requirement_hashes.get(requirement_id) == entry["hash"]}
+    if ctx.manifest is not None:
+        print(f"Section {section_index}/{section_count}: Regenerating {requirement_count - len(stored_steps)}/{requirement_count} requirements")
 
-    readme = open(os.path.join(out_dir, "README.md"), "w")
-    readme.write("# OWASP ASVS Testing Guide\n  \n")
+    section_intro_prompt = f"You are writing a practical Testing Guide for the OWASP {ctx.name}."
+    section_intro_prompt += f"Produce the Introduction for the collection of requirements under \"{section_name}\" (a sub section of {chapter_name})."
+    section_intro_prompt += f"The introduction will be inserted under a markdown header `## Introduction`."
 
-    readme.write("This guide is designed to help you test a web or mobile app against the OWASP Application Security Verification Standard (ASVS).  \n")
-    readme.write("It is divided into different chapters based on the ASVS requirement groups.\n  \n")
-    
-    readme.write("## Table of Contents\n  \n")
+    print(f"Section {section_index}/{section_count}: Generating Intro")
+    tags = {"kind": "section", "chapter": chapter_name, "section": section_name}
+    section_intro, section_messages = await ask(ctx, chapter_messages, section_intro_prompt, {**tags, "part": "intro"}, stored_parts.get("intro"))
 
-    model_id = config.get("model_id", os.getenv("OPENAI_MODEL"))
-    
-    chapter_index = 0
-    chapter_count = len(requirements["Requirements"])
+    print(f"Chapter Section {section_index}/{section_count} Generating Pre-requisites")
 
-    for chapter in requirements["Requirements"]:
-        chapter_index += 1
-        chapter_messages = doc_messages.copy()
+    section_prereq_prompt = f"Add any further detail that someone following this guide might need at this juncture (related to section: {section_name})"
+    section_prereq_prompt +=", before we start looking at specific requirements."
 
-        chapter_code = f"{name}V{version}-{chapter['Shortcode'][1:]}"
-        chapter_shortCode = chapter['Shortcode']
-        chapter_shortName = chapter["ShortName"]
+    section_prereq_prompt += "\nIf relevant, including a list of any prerequisites and step-by-step instructions for any setup."
+    section_prereq_prompt += "\nIf relevant, assume a modern web application using modern standards like TLS."
+    section_prereq_prompt += f"\nIf you can, make the example technology agnostic; if you cannot then assume a {ctx.tech_stack}."
+    section_prereq_prompt += "Include a markdown second-level heading appropriate for this section of the document."
 
-        chapter_name = f"{chapter_shortCode} {chapter_shortName}"
-        chapter_file_name = chapter_name.replace(" ", "_")
+    section_prereq, section_messages = await ask(ctx, section_messages, section_prereq_prompt, {**tags, "part": "prereq"}, stored_parts.get("prereq"))
 
-        print(f"Working on Chapter {chapter_index}/{chapter_count}: {chapter_name}")
+    # sibling requirements only depend on the section prefix, so they can all be requested at once
+    requirements = await asyncio.gather(*(
+        generate_requirement(ctx, section_messages, section_intro, chapter_name, section_name, requirement,
+                             (requirement_index, requirement_count, chapter_index, chapter_count, section_index, section_count),
+                             stored_steps.get(requirement['Shortcode']))
+        for requirement_index, requirement in enumerate(section["Items"], start=1)
+    ))
 
-        chapter_dir = os.path.join(out_dir, chapter_file_name)
+    section_path = os.path.join(chapter_dir, f"{section_file_name}.md")
+    on_written = None
 
-        if not os.path.exists(chapter_dir):
-            os.makedirs(chapter_dir)
+    # a section with invalid responses is never current, so it's tried again on the next run (reusing the parts that were valid)
+    responses = [section_intro, section_prereq] + [requirement['steps'] for requirement in requirements]
+    if ctx.manifest is not None:
+        file_hash = get_section_file_hash(ctx.version, section_hash, section) if INVALID_RESPONSE not in responses else None
+        valid_steps = {requirement['id']: {"hash": requirement_hashes[requirement['id']], "steps": requirement['steps']}
+                       for requirement in requirements if requirement['steps'] != INVALID_RESPONSE}
+        on_written = lambda: ctx.manifest.update(section_key, file_hash, section_path, parts_hash=section_hash, # type: ignore
+                                                 parts=get_valid_parts(intro=section_intro, prereq=section_prereq), requirements=valid_steps)
 
-        readme.write(f"- [{chapter_name}](./{chapter_file_name}/README.md)\n")
+    ctx.writer.write(section_path, render_section(section_name, section_code, section_intro, section_prereq, requirements), on_written)
+
+def render_section(section_name, section_code, section_intro, section_prereq, requirements) -> str:
+    # TODO:: Add meta-data via markdown comments incl. ASVS version & req number, and agregated L1/2/3 required status + CWE & NIST references
 
-        chapter_readme = open(os.path.join(chapter_dir, "README.md"), "w")
-        chapter_readme.write(f"# {chapter_name}\n  \n")
+    section_file = [f"# {section_name}\n"]
+
+    if section_intro != INVALID_RESPONSE:
+        section_file.append(f"\n## Introduction\n\n  ")
+        section_file.append(f"\n{section_intro}  \n\n")
+
+    if section_prereq != INVALID_RESPONSE:
+        section_file.append(f"\n{section_prereq}  \n\n")
 
-        chapter_intro_prompt = f"You are writing a practical Testing Guide for the OWASP {name} v{version}."
-        chapter_intro_prompt += f"Produce the Introduction for the high level collection of requirements \"{chapter_name}\" ({chapter_code})."
-        chapter_intro_prompt += f"The introduction will be inserted under a markdown header `## Introduction`."
+    section_file.append(f"## {section_code} Requirements\n  \n")
 
-        print(f"Chapter {chapter_index}/{chapter_count}: Generating Intro")
-        chapter_messages.append({"role": "user", "content": chapter_intro_prompt})
-        chapter_intro_response = openai.ChatCompletion.create(
-                        model=model_id,
-                        messages=chapter_messages
-                    )
+    for requirement in requirements:
+        section_file.append(f"### {requirement['id']}  \n  \n")
+        section_file.append(f"Ref: {requirement['code']}  \n")
+        section_file.append(f"ASV Level: {requirement['level']} \n  \n")
 
-        chapter_intro = chapter_intro_response['choices'][0]['message']['content'] # type: ignore
-        chapter_messages.append({"role": "assistant", "content": chapter_intro})
+        if requirement['level_description']:
+            section_file.append(f"ASV Requirement: {requirement['level_description']} \n  \n")
 
-        if chapter_intro.startswith("I'm sorry, but as an AI language model"):
-            print(f"ERROR: Chapter: {chapter_code} ({chapter_index}/{chapter_count} Intro: {chapter_intro}")
-            chapter_intro = "OPENAI_ERROR_INVALID_RESPONSE"
-        else:
-            chapter_readme.write(f"\n## Introduction\n\n  ")
-            chapter_readme.write(f"\n{chapter_intro}  \n\n")
-      
-        chapter_prereq_prompt = f"Add any further detail that someone following this guide might need at this juncture (related to section: {chapter_name})"
-        chapter_prereq_prompt +=", before we start looking at the groups of requirements within this category."
-
-        chapter_prereq_prompt += "\nIf relevant, including a list of any prerequisite tools and any relevant step-by-step instructions for their setup."
-        chapter_prereq_prompt += "\nIf relevant, assume a modern web application using modern standards like TLS."
-        chapter_prereq_prompt += "\nIf you can, make the example technology agnostic; if you cannot then assume a {default_tech_stack}."
-        chapter_prereq_prompt += "Include a markdown second-level heading appropriate for this section of the document."
-
-        print(f"Chapter {chapter_index}/{chapter_count}: Generating Pre-requisites")
-        chapter_messages.append({"role": "user", "content": chapter_prereq_prompt})
-        chapter_prereq_responses = openai.ChatCompletion.create(
-                        model=model_id,
-                        messages=chapter_messages
-                    )
-
-        chapter_prereq = chapter_prereq_responses['choices'][0]['message']['content'] # type: ignore
-        chapter_messages.append({"role": "assistant", "content": chapter_prereq})
-
-        if chapter_prereq.startswith("I'm sorry, but as an AI language model"):
-            print(f"ERROR: Chapter: {chapter_code} ({chapter_index}/{chapter_count} Notes: {chapter_prereq}")
-            chapter_prereq = "OPENAI_ERROR_INVALID_RESPONSE"
+        # TODO:: link to relevant CWE or NIST references
+
+        section_file.append(f"{requirement['description']}  \n  \n")
+
+        if requirement['steps'] != INVALID_RESPONSE:
+            section_file.append(f"\n#### *Steps to Verify Requirement:*  \n  \n")
+            section_file.append(f"\n{requirement['steps']}  \n  \n")
+
+    return "".join(section_file)
+
+async def generate_chapter(ctx: GuideContext, out_dir, doc_messages, chapter, position):
+    chapter_index, chapter_count = position
+
+    chapter_key = get_node_key(ctx, chapter['Shortcode'])
+    chapter_shortCode = chapter['Shortcode']
+    chapter_shortName = chapter["ShortName"]
+
+    chapter_name = f"{chapter_shortCode} {chapter_shortName}"
+    chapter_file_name = chapter_name.replace(" ", "_")
+
+    print(f"Working on Chapter {chapter_index}/{chapter_count}: {chapter_name}")
+
+    chapter_dir = os.path.join(out_dir, chapter_file_name)
+    chapter_readme_path = os.path.join(chapter_dir, "README.md")
+
+    section_count = len(chapter["Items"])
+    sections = []
+    for section_index, section in enumerate(chapter["Items"], start=1):
+        if len(section["Items"]) < 1:
+            print(f"Skipping placeholder section {section_index}/{section_count}: {get_section_name(chapter_shortCode, section)}.")
         else:
-            chapter_readme.write(f"\n{chapter_prereq}  \n\n")
-
-        chapter_readme.write("## Sections\n  \n")
-
-        section_index = 0
-        section_count = len(chapter["Items"])
-        for section in chapter["Items"]:
-            section_index += 1
-            requirement_count = len(section["Items"])
-
-            section_messages = chapter_messages.copy()
-            section_code = f"{name}V{version}-{section['Shortcode'][1:]}"
-            section_name = f"{chapter_shortCode}.{section['Shortcode'][1:]} {section['Name']}"
-            section_file_name = section_name.replace(" ", "_")
-
-            if requirement_count < 1:
-                print(f"Skipping placeholder section {section_index}/{section_count}: {section_name}.")
-                continue
-            else:
-                print(f"Working on Section: {section_code} ({section_index}/{section_count}) - {section_name}.")
-
-            chapter_readme.write(f"- [{section_name}](./{section_file_name}.md)\n")
-
-            section_file = open(os.path.join(chapter_dir, f"{section_file_name}.md"), "w")
-
-            # TODO:: Add meta-data via markdown comments incl. ASVS version & req number, and agregated L1/2/3 required status + CWE & NIST references
-
-            section_file.write(f"# {section_name}\n")
-
-            section_intro_prompt = f"You are writing a practical Testing Guide for the OWASP {name} v{version}."
-            section_intro_prompt += f"Produce the Introduction for the collection of requirements under \"{section_name}\" (a sub section of {chapter_name})."
-            section_intro_prompt += f"The introduction will be inserted under a markdown header `## Introduction`."
-
-            print(f"Section {section_index}/{section_count}: Generating Intro")
-            section_messages.append({"role": "user", "content": section_intro_prompt})
-            section_intro_response = openai.ChatCompletion.create(
-                            model=model_id,
-                            messages=section_messages
-                        )
-
-            section_intro = section_intro_response['choices'][0]['message']['content'] # type: ignore
-            section_messages.append({"role": "assistant", "content": section_intro})
-
-            if section_intro.startswith("I'm sorry, but as an AI language model"):
-                print(f"ERROR: Section: {section_code} ({section_index}/{section_count} Intro: {section_intro}")
-                section_intro = "OPENAI_ERROR_INVALID_RESPONSE"
-            else:
-                section_file.write(f"\n## Introduction\n\n  ")
-                section_file.write(f"\n{section_intro}  \n\n")
-
-            print(f"Chapter Section {section_index}/{section_count} Generating Pre-requisites")
-
-            section_prereq_prompt = f"Add any further detail that someone following this guide might need at this juncture (related to section: {section_name})"
-            section_prereq_prompt +=", before we start looking at specific requirements."
-
-            section_prereq_prompt += "\nIf relevant, including a list of any prerequisites and step-by-step instructions for any setup."
-            section_prereq_prompt += "\nIf relevant, assume a modern web application using modern standards like TLS."
-            section_prereq_prompt += "\nIf you can, make the example technology agnostic; if you cannot then assume a {default_tech_stack}."
-            section_prereq_prompt += "Include a markdown second-level heading appropriate for this section of the document."
-            
-            section_messages.append({"role": "user", "content": section_prereq_prompt})
-            section_prereq_response = openai.ChatCompletion.create(
-                            model=model_id,
-                            messages=section_messages
-                        )
-
-            section_prereq = section_prereq_response['choices'][0]['message']['content'] # type: ignore
-            section_messages.append({"role": "assistant", "content": section_prereq})
-
-            if section_prereq.startswith("I'm sorry, but as an AI language model"):
-                print(f"ERROR: Section: {section_code} ({section_index}/{section_count} Prereq: {section_prereq}")
-                section_prereq = "OPENAI_ERROR_INVALID_RESPONSE"
-            else:
-                section_file.write(f"\n{section_prereq}  \n\n")
-
-            section_file.write(f"## {section_code} Requirements\n  \n")
-            
-            requirement_index = 0
-            for requirement in section["Items"]:
-                requirement_index += 1
-                requirement_messages = section_messages.copy()
-                requirement_id = requirement['Shortcode']
-                requirement_code = f"{name}V{version}-{requirement_id[1:]}"
-                requirement_description = requirement['Description']
-
-                print(f"Working on Requirement {requirement_index}/{requirement_count}: {requirement_id} (Chapter: {chapter_index}/{chapter_count} Section: {section_index}/{section_count})")
-
-                section_file.write(f"### {requirement_id}  \n  \n")
-                section_file.write(f"Ref: {requirement_code}  \n")
-
-                if requirement['L3']['Required']:
-                    requirement_level = "3"
-                    requirements_description = requirement['L3']['Requirement']
-                elif requirement['L2']['Required']:
-                    requirement_level = "2"
-                    requirements_description = requirement['L2']['Requirement']
-                elif requirement['L1']['Required']:
-                    requirement_level = "1"
-                    requirements_description = requirement['L1']['Requirement']
-                else:
-                    requirement_level = "0"
-                    requirements_description = "[optional depending on context]"
-
-                section_file.write(f"ASV Level: {requirement_level} \n  \n")
-
-                if requirements_description:
-                    section_file.write(f"ASV Requirement: {requirements_description} \n  \n")
-
-                # TODO:: link to relevant CWE or NIST references
-
-                section_file.write(f"{requirement_description}  \n  \n")
-
-                request_steps = f"Produce a step-by-step guide to test the OWASP ASVS requirement: {requirement_id} ({requirement_code})."
-                request_steps += f"\nThe Requirement is from Chapter: \"{chapter_name}\", Section: \"{section_name}\"."
-                request_steps += f"\nRequirement details: \"{requirement_description}\"."
-                request_steps += f"\nApplication Security Verification (ASV) Level: {requirement_level}."
-                
-                if requirements_description:
-                    request_steps += " ASV Requirement: {requirements_description}."
-
-                request_steps += "\nIf relevant, assume a modern web application and infer that it should be using modern best practice."
-                request_steps += "\nIf you can, make the example technology agnostic; if you cannot, then assume a {default_tech_stack}."
-                request_steps += "\nContent is to be included directly into a markdown file (under a third-level heading for this requirement)"
-                request_steps += "; so do not include additional description of what you're producing, or platitudes etc. in your response."
-                request_steps += "\nBreak down the content as needed using appropriate markdown headers etc."
-
-                print(f"Chapter {chapter_index}/{chapter_count} Section {section_index}/{section_count} Req {requirement_index}/{requirement_count}: Generating Steps")
-                requirement_messages.append({"role": "user", "content": request_steps})
-                requirement_steps_response = openai.ChatCompletion.create(
-                                model=model_id,
-                                messages=requirement_messages
-                            )
-
-                requirement_steps = requirement_steps_response['choices'][0]['message']['content'] # type: ignore
-                requirement_messages.append({"role": "assistant", "content": requirement_steps})
-
-                if section_intro.startswith("I'm sorry, but as an AI language model"):
-                    print(f"ERROR: Requirement: {requirement_code} Steps: {requirement_steps}")
-                    requirement_steps = "OPENAI_ERROR_INVALID_RESPONSE"
-                else:
-                    section_file.write(f"\n#### *Steps to Verify Requirement:*  \n  \n")
-                    section_file.write(f"\n{requirement_steps}  \n  \n")
-
-                
-            section_file.close()
-
-        chapter_readme.close()
-
-    readme.close()
+            sections.append((section_index, section))
+
+    # each section depends on its chapter's intro & pre-requisites, so a change to the chapter regenerates all of them
+    chapter_hash = get_hash(ctx.guide_hash, chapter_shortCode, chapter_shortName)
+    # the README's hash includes the sections it links to, so it's rewritten once a section that failed has been written
+    get_readme_hash = lambda listed: get_hash(chapter_hash, [get_section_name(chapter_shortCode, section) for section in listed])
+    chapter_readme_hash = get_readme_hash([section for _, section in sections])
+    section_hashes = {section_index: get_section_hash(chapter_hash, section) for section_index, section in sections}
+    section_keys = {section_index: get_node_key(ctx, section['Shortcode']) for section_index, section in sections}
+
+    ctx.nodes.add(chapter_key)
+    ctx.nodes.update(section_keys.values())
+
+    readme_current = ctx.manifest is not None and ctx.manifest.is_current(chapter_key, chapter_readme_hash)
+    changed_sections = [(section_index, section) for section_index, section in sections
+                        if ctx.manifest is None or not ctx.manifest.is_current(
+                            section_keys[section_index], get_section_file_hash(ctx.version, section_hashes[section_index], section))]
+
+    if readme_current and not changed_sections:
+        print(f"Chapter {chapter_index}/{chapter_count}: Up to date")
+        return
+
+    if ctx.manifest is not None:
+        readme_status = "" if readme_current else "README & "
+        print(f"Chapter {chapter_index}/{chapter_count}: Regenerating {readme_status}{len(changed_sections)}/{len(sections)} sections")
+
+    if not os.path.exists(chapter_dir):
+        os.makedirs(chapter_dir)
+
+    # the intro & pre-requisites are reused if they were generated from the same inputs, so the sections that have
+    # changed carry on from the same chapter as the others (and the README, if it's current, matches them)
+    stored = get_stored(ctx, chapter_key)
+    stored_parts = stored.get("parts", {}) if stored.get("parts_hash") == chapter_hash else {}
+
+    chapter_intro_prompt = f"You are writing a practical Testing Guide for the OWASP {ctx.name}."
+    chapter_intro_prompt += f"Produce the Introduction for the high level collection of requirements \"{chapter_name}\"."
+    chapter_intro_prompt += f"The introduction will be inserted under a markdown header `## Introduction`."
+
+    print(f"Chapter {chapter_index}/{chapter_count}: Generating Intro")
+    tags = {"kind": "chapter", "chapter": chapter_name}
+    chapter_intro, chapter_messages = await ask(ctx, doc_messages, chapter_intro_prompt, {**tags, "part": "intro"}, stored_parts.get("intro"))
+
+    chapter_prereq_prompt = f"Add any further detail that someone following this guide might need at this juncture (related to section: {chapter_name})"
+    chapter_prereq_prompt +=", before we start looking at the groups of requirements within this category."
+
+    chapter_prereq_prompt += "\nIf relevant, including a list of any prerequisite tools and any relevant step-by-step instructions for their setup."
+    chapter_prereq_prompt += "\nIf relevant, assume a modern web application using modern standards like TLS."
+    chapter_prereq_prompt += f"\nIf you can, make the example technology agnostic; if you cannot then assume a {ctx.tech_stack}."
+    chapter_prereq_prompt += "Include a markdown second-level heading appropriate for this section of the document."
+
+    print(f"Chapter {chapter_index}/{chapter_count}: Generating Pre-requisites")
+    chapter_prereq, chapter_messages = await ask(ctx, chapter_messages, chapter_prereq_prompt, {**tags, "part": "prereq"}, stored_parts.get("prereq"))
+
+    # sibling sections only depend on the chapter prefix, so they can all be generated at once
+    results = await asyncio.gather(*(
+        generate_section(ctx, chapter_dir, chapter_messages, chapter_name, chapter_shortCode, section, section_hashes[section_index],
+                         (section_index, section_count, chapter_index, chapter_count))
+        for section_index, section in changed_sections
+    ), return_exceptions=True)
+
+    # the table of contents only links to the sections that have been written, i.e. those that are unchanged, were
+    # generated now, or are left over from a previous run
+    changed = {section_index: result for (section_index, _), result in zip(changed_sections, results)}
+    listed = [section for section_index, section in sections
+              if section_index not in changed or not isinstance(changed[section_index], BaseException)
+              or os.path.exists(os.path.join(chapter_dir, f"{get_section_name(chapter_shortCode, section).replace(' ', '_')}.md"))]
+    listed_readme_hash = get_readme_hash(listed)
+    # also rewritten if the intro or pre-requisites weren't stored (e.g. they were invalid last time), so it matches the sections
+    regenerated_parts = get_valid_parts(intro=chapter_intro, prereq=chapter_prereq) != stored_parts
+    if ctx.manifest is None or regenerated_parts or not ctx.manifest.is_current(chapter_key, listed_readme_hash):
+        write_chapter_readme(ctx, chapter_readme_path, chapter_key, listed_readme_hash, chapter_hash, chapter_name, chapter_shortCode,
+                             chapter_intro, chapter_prereq, listed)
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+def write_chapter_readme(ctx: GuideContext, path, chapter_key, chapter_readme_hash, chapter_hash, chapter_name, chapter_shortCode,
+                         chapter_intro, chapter_prereq, sections):
+    on_written = None
+    if ctx.manifest is not None:
+        # a README with an invalid intro or pre-requisites is never current, so they're asked for again on the next run
+        readme_hash = chapter_readme_hash if INVALID_RESPONSE not in (chapter_intro, chapter_prereq) else None
+        on_written = lambda: ctx.manifest.update(chapter_key, readme_hash, path, parts_hash=chapter_hash, # type: ignore
+                                                 parts=get_valid_parts(intro=chapter_intro, prereq=chapter_prereq))
+
+    chapter_readme = [f"# {chapter_name}\n  \n"]
+
+    if chapter_intro != INVALID_RESPONSE:
+        chapter_readme.append(f"\n## Introduction\n\n  ")
+        chapter_readme.append(f"\n{chapter_intro}  \n\n")
+
+    if chapter_prereq != INVALID_RESPONSE:
+        chapter_readme.append(f"\n{chapter_prereq}  \n\n")
+
+    chapter_readme.append("## Sections\n  \n")
+
+    for section in sections:
+        section_name = get_section_name(chapter_shortCode, section)
+        chapter_readme.append(f"- [{section_name}](./{section_name.replace(' ', '_')}.md)\n")
+
+    ctx.writer.write(path, "".join(chapter_readme), on_written)
+
+def render_guide_readme(chapters) -> str:
+    readme = ["# OWASP ASVS Testing Guide\n  \n"]
+
+    readme.append("This guide is designed to help you test a web or mobile app against the OWASP Application Security Verification Standard (ASVS).  \n")
+    readme.append("It is divided into different chapters based on the ASVS requirement groups.\n  \n")
+
+    readme.append("## Table of Contents\n  \n")
+
+    for chapter in chapters:
+        chapter_name = f"{chapter['Shortcode']} {chapter['ShortName']}"
+        readme.append(f"- [{chapter_name}](./{chapter_name.replace(' ', '_')}/README.md)\n")
+
+    return "".join(readme)
+
+@dataclass
+class GuideJob:
+    """One variant of the guide: what it's generated from, what its examples assume & where it's written."""
+    out_dir: str
+    requirements: dict
+    doc_messages: List[Dict[str, str]]
+    tech_stack: str
+    manifest: Optional[GuideManifest] = None
+
+async def generate_guide(ctx: GuideContext, out_dir, requirements, doc_messages):
+    chapter_count = len(requirements["Requirements"])
+
+    # every chapter carries on to the end if another fails, so everything that can be written is
+    results = await asyncio.gather(*(
+        generate_chapter(ctx, out_dir, doc_messages, chapter, (chapter_index, chapter_count))
+        for chapter_index, chapter in enumerate(requirements["Requirements"], start=1)
+    ), return_exceptions=True)
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+def finish_guide(ctx: GuideContext, out_dir, requirements, complete=True):
+    # remove the files of chapters & sections that are no longer in the requirements (only once the guide's complete,
+    # so a failed run never removes anything it didn't get to)
+    if ctx.manifest is not None and complete:
+        removed = ctx.manifest.remove_stale(ctx.nodes)
+        if removed:
+            print(f"Removed {removed} chapters/sections no longer in {ctx.name} v{ctx.version} ({ctx.label})")
+
+    # the table of contents only links to the chapters that have been written (the manifest may have been carried
+    # over from the previous release, so it's no guide to what's in this one's directory)
+    chapters = [chapter for chapter in requirements["Requirements"]
+                if os.path.exists(os.path.join(out_dir, f"{chapter['Shortcode']}_{chapter['ShortName']}".replace(" ", "_"), "README.md"))]
+    write_atomic(os.path.join(out_dir, "README.md"), render_guide_readme(chapters).encode("utf-8"))
+
+async def generate_guides(jobs: List[GuideJob], model_id, client, max_concurrent_requests, cache=None, batch_client=None, validators=None,
+                          max_regenerations=2, params=None):
+    """
+    Generates every guide in `jobs` at once, over one worker pool, limiter & writer (and in batch mode, one set
+    of batches), so they take about as long as the slowest of them rather than all of them put together.
+
+    Requests that are the same for several guides (e.g. the chapter intros of guides that only differ by tech
+    stack) are only sent once. If a guide fails the others carry on, and the first failure is raised at the end.
+
+    Each response is checked by `validators` & asked for again up to `max_regenerations` times if it fails, with
+    `params` (e.g. `max_tokens`) sent with every request.
+    """
+    pending: Dict[str, "asyncio.Future[str]"] = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrent_requests) as executor:
+        # in batch mode each level of the guides (chapter intros, chapter pre-requisites, ... requirements) is sent as one batch
+        batcher = AsyncBatcher(batch_client, executor) if batch_client is not None else None
+        # files are rendered as soon as their content is generated, and written in the background
+        writer = AtomicWriter(executor)
+        writer.start()
+        limiter = asyncio.Semaphore(max_concurrent_requests)
+
+        contexts = []
+        for job in jobs:
+            name = job.requirements["ShortName"]
+            version = job.requirements["Version"]
+            # the version's left out (as it is from the prompts), so content carried over from the previous release's manifest is reused
+            guide_hash = get_hash(PROMPT_VERSION, model_id, job.doc_messages, name, job.tech_stack)
+            contexts.append(GuideContext(name, version, os.path.basename(job.out_dir), job.tech_stack, model_id, client, limiter, executor,
+                                         writer, cache, batcher, job.manifest, guide_hash, validators=validators or [],
+                                         max_regenerations=max_regenerations, params=params or {}, pending=pending))
+
+        try:
+            results = await asyncio.gather(*(
+                generate_guide(ctx, job.out_dir, job.requirements, job.doc_messages) for ctx, job in zip(contexts, jobs)
+            ), return_exceptions=True)
+        finally:
+            # keep everything that was generated, even if the run fails
+            await writer.close()
+            print(f"Wrote {writer.files} files ({writer.bytes} bytes)")
+            print(f"Validation: {sum(ctx.regenerated for ctx in contexts)} responses regenerated, "
+                  f"{sum(ctx.invalid for ctx in contexts)} still invalid")
+
+    # the table of contents of a guide that failed still links to the chapters that were written
+    errors = []
+    for ctx, job, result in zip(contexts, jobs, results):
+        if isinstance(result, BaseException):
+            print(f"Error generating {ctx.label}: {result}")
+            errors.append(result)
+        finish_guide(ctx, job.out_dir, job.requirements, complete=not isinstance(result, BaseException))
+
+    if errors:
+        raise errors[0]
+
+def get_guide_dir_name(guide, requirements) -> str:
+    if guide.get("name"):
+        return guide["name"]
+
+    dir_name = f"{requirements['ShortName']}_{requirements['Version']}"
+    if guide.get("language", "en") != "en":
+        dir_name += f"_{guide['language']}"
+    if guide.get("tech_stack"):
+        dir_name += "_" + re.sub(r"[^\w.]+", "-", guide["tech_stack"]).strip("-")
+    return dir_name
+
+def get_version_key(version: str) -> Optional[Tuple[int, ...]]:
+    return tuple(int(part) for part in version.split(".")) if re.fullmatch(r"\d+(\.\d+)*", version) else None
+
+def get_previous_guide_dir(docs_dir, guide, requirements) -> Optional[str]:
+    """
+    Returns the directory of the same guide for the latest earlier release in `docs_dir` that has a manifest, if there is one.
+
+    A guide with its own `name` is written to the same directory for every release, so it never has one.
+    """
+    version = get_version_key(requirements["Version"])
+    if guide.get("name") or version is None or not os.path.isdir(docs_dir):
+        return None
+
+    # the directory name is the same for every release, apart from the version
+    prefix, suffix = get_guide_dir_name(guide, {**requirements, "Version": "\0"}).split("\0")
+    previous = []
+    for dir_name in os.listdir(docs_dir):
+        if dir_name.startswith(prefix) and dir_name.endswith(suffix) and len(dir_name) > len(prefix) + len(suffix):
+            dir_version = get_version_key(dir_name[len(prefix):len(dir_name) - len(suffix)])
+            if dir_version is not None and dir_version < version and os.path.exists(os.path.join(docs_dir, dir_name, "manifest.json")):
+                previous.append((dir_version, dir_name))
+
+    return os.path.join(docs_dir, max(previous)[1]) if previous else None
+
+def create_directory_structure_and_files(output_dir, guides, docs_dir, backend):
+    """
+    Generates a guide for each of `guides`, a list of `(guide, requirements)` where `guide` is an entry from the
+    `guides` config (or `{}` for the default guide) & `requirements` are the ASVS requirements it's for.
+    """
+    system_commands = config.get("system_commands")
+    docs_dir = os.path.join(output_dir, docs_dir)
+
+    if not os.path.exists(docs_dir):
+        os.makedirs(docs_dir)
+
+    model_id = config.get("model_id", os.getenv("OPENAI_MODEL"))
+    tech_stack = config.get("tech_stack", DEFAULT_TECH_STACK)
+    incremental = config.get("incremental", True)
+
+    jobs = []
+    for guide, requirements in guides:
+        out_dir = os.path.join(docs_dir, get_guide_dir_name(guide, requirements))
+        if any(job.out_dir == out_dir for job in jobs):
+            raise ValueError(f"More than one guide would be written to '{out_dir}', give them each a different `name`")
+
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+
+        doc_messages = get_system_commands("ASVS Bot", system_commands)
+        language = guide.get("language", "en")
+        if language != "en":
+            doc_messages[0]["content"] += f"\nWrite in the language of the requirements (`{language}`), rather than English."
+
+        # the manifest records what each file was generated from, so only files whose requirements, model or prompts have changed are
+        # regenerated; a new release's guide starts from the previous release's manifest, so only what's changed in between is asked for
+        manifest = None
+        if incremental:
+            previous_dir = get_previous_guide_dir(docs_dir, guide, requirements)
+            manifest = GuideManifest(os.path.join(out_dir, "manifest.json"), os.path.join(previous_dir, "manifest.json") if previous_dir else None,
+                                     model=model_id, prompt_version=PROMPT_VERSION)
+            if manifest.carried_over:
+                print(f"Carrying over {manifest.carried_over} chapters/sections from {os.path.basename(previous_dir)}") # type: ignore
+        jobs.append(GuideJob(out_dir, requirements, doc_messages, guide.get("tech_stack", tech_stack), manifest))
+
+    trace_dir = config.get("trace_dir", os.path.join("cache", "traces"))
+    trace_path = os.path.join(trace_dir, f"generate-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl") if trace_dir else None
+    telemetry = Telemetry(trace_path, config.get("prices"))
+    client = ChatClient.from_config(config, backend, telemetry)
+    max_concurrent_requests = config.get("max_concurrent_requests", 4)
+    cache_path = config.get("completion_cache", os.path.join("cache", "completions.jsonl"))
+    cache = CompletionCache(cache_path) if cache_path else None
+    batch_client = BatchClient.from_config(config, backend) if config.get("batch", False) else None
+    validators = get_validators(config)
+    params = {"max_tokens": config["max_tokens"]} if config.get("max_tokens") else {}
+
+    try:
+        asyncio.run(generate_guides(jobs, model_id, client, max_concurrent_requests, cache, batch_client, validators,
+                                    config.get("max_regenerations", 2), params))
+    finally:
+        if cache is not None:
+            print(f"Completion cache: {cache.hits} hits, {cache.misses} misses ({cache_path})")
+            cache.close()
+        print(f"Prompt cache: {client.usage.report()}")
+        if batch_client is not None:
+            print(f"Prompt cache (batches): {batch_client.usage.report()}")
+        print(telemetry.report(group_by="guide" if len(jobs) > 1 else "chapter"))
+        if trace_path:
+            print(f"Trace: {trace_path}")
+        telemetry.close()
 
 def main():
     if not sys.stdin.isatty():
@@ -363,20 +816,26 @@ def main():
 
     load_dotenv()
 
-    openai.api_key = config.get("api_key", os.getenv("OPENAI_KEY"))
-    openai.organization = config.get("org_id", os.getenv("OPENAI_ORG"))
-
+    backend = get_backend(config)
     model_id = config.get("model_id", os.getenv("OPENAI_MODEL"))
-    validate_openai_config(model_id)
+    validate_config(backend, model_id)
 
-    output_dir = "/home/vscode"
-    repo_name = "owasp-asvs-testing-guide"
+    output_dir = config.get("output_dir", "/home/vscode")
+    repo_name = config.get("repo_name", "owasp-asvs-testing-guide")
     folder_name = "testing-guide"
 
     username = get_logged_in_username()
-    requirements = fetch_asvs_requirements()
+    http = HttpCache(config.get("download_cache", os.path.join("cache", "downloads")), config.get("http_timeout", (10, 60)))
+    try:
+        # each entry of `guides` is a variant of the guide, by default just the latest release in English
+        guides = [(guide, fetch_asvs_requirements(http, config.get("requirements_cache", os.path.join("cache", "requirements")),
+                                                  config.get("asvs_release_url", "https://api.github.com/repos/OWASP/ASVS/releases/latest"),
+                                                  config.get("asvs_release_max_age", 3600), guide.get("version"), guide.get("language", "en")))
+                  for guide in config.get("guides") or [{}]]
+    finally:
+        http.close()
     create_repo(output_dir, username, repo_name, False)
-    create_directory_structure_and_files(os.path.join(output_dir, repo_name), requirements, folder_name)
+    create_directory_structure_and_files(os.path.join(output_dir, repo_name), guides, folder_name, backend)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,31 +1,54 @@
+import argparse
 import sys
-from dotenv import load_dotenv
+from concurrent.futures import Future
+from datetime import datetime
 import json
-import openai
 import os
 import random
 import re
-from typing import Dict, List
-from varname import nameof
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from backends import ModelBackend, ModelListCache, get_backend
+from chat_client import ChatClient, is_api_error, stream_content
+from fan_out import FanOut, get_fan_out
+from history import ConversationHistory, HistoryStrategy, get_history_strategy
+from semantic_cache import SemanticCache, get_semantic_cache
+from telemetry import Telemetry
+from transcripts import TranscriptStore
 
 with open("config.json") as f:
     config = json.load(f)
 
-def is_valid_model(id: str) -> bool:
-    response = openai.Model.list()
-    return response is not None and id in [model['id'] for model in response['data']] # type: ignore
-
-def validate_openai_config(model_id: str) -> None:
-    if openai.organization is None:
-        print(f"Error: {nameof(openai)}.{nameof(openai.organization)} is not set.")
-        exit(1)
-    if openai.api_key is None:
-        print(f"Error: {nameof(openai)}.{nameof(openai.api_key)} is not set.")
-        exit(1)
-    if not is_valid_model(model_id):
-        print(f"Error: '{model_id}' is not a valid model.")
+def validate_config(backend: ModelBackend) -> None:
+    for error in backend.get_config_errors():
+        print(f"Error: {error}")
         exit(1)
 
+def validate_model(backend: ModelBackend, model_id: str, cache: Optional[ModelListCache] = None) -> Optional[str]:
+    """
+    Returns an error if `model_id` isn't one of the backend's models.
+    """
+    if not backend.is_valid_model(model_id, cache):
+        return f"'{model_id}' is not a valid model."
+    return None
+
+def validate_model_in_background(backend: ModelBackend, model_id: str, cache: Optional[ModelListCache] = None) -> "Future[Optional[str]]":
+    """
+    Runs `validate_model` on a daemon thread, so it never holds up startup or exiting.
+    """
+    future: "Future[Optional[str]]" = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(validate_model(backend, model_id, cache))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
 def get_system_commands(system_name: str, system_commands: list[str]) -> list[dict[str, str]]:
     system_commands = [cmd.format(system_name=system_name) for cmd in system_commands]
     return [{"role": "system", "content": "\n".join(system_commands)}]
@@ -47,6 +70,36 @@ def print_system_response(system_name: str, response_content: str, pad: int) ->
     print()
     print(f"{sys_prompt}{response_content}{reset_colour}")
 
+def print_system_response_stream(system_name: str, response_chunks: Iterable[str], pad: int) -> str:
+    """
+    Prints the personal assistant's response as it is generated.
+
+    Args:
+        system_name (str): The username of the personal assistant.
+        response_chunks (Iterable[str]): The pieces of the response content, in order.
+        pad (int): The padding to use for formatting the response.
+
+    Returns:
+        str: The full response content.
+    """
+    reset_colour = "\033[0m"
+    sys_colour = '\033[38;2;0;191;255m'  # medium light blue
+    response_colour = '\033[38;2;153;204;255m'  # slightly lighter shade of blue
+    sys_prompt = f"{sys_colour}{(system_name + ':').ljust(pad, ' ')}{response_colour}"
+
+    print()
+    print(sys_prompt, end='', flush=True)
+
+    response_content = []
+    try:
+        for chunk in response_chunks:
+            response_content.append(chunk)
+            print(chunk, end='', flush=True)
+    finally:
+        print(reset_colour)
+
+    return "".join(response_content)
+
 def get_user_input(username: str, pad: int) -> str:
     """
     Prompts the user for input and returns the input as a string.
@@ -69,17 +122,47 @@ def get_user_input(username: str, pad: int) -> str:
 
     return prompt
 
-def start_conversation(model_id: str, user_name: str, system_name: str, system_commands: list[str]) -> List[Dict[str, str]]:
+def print_sessions(sessions: List[Dict[str, str]]) -> None:
+    for session in sessions:
+        print(f"{session['session']}  {session.get('created', '')[:19]}  {session['messages']:>4} messages  {session.get('title', '')}")
+
+def start_conversation(client: ChatClient, model_id: str, user_name: str, system_name: str, system_commands: list[str],
+                       history_strategy: Optional[HistoryStrategy] = None, max_request_tokens: Optional[int] = None, stream: bool = True,
+                       transcript: Optional[TranscriptStore] = None, session_id: Optional[str] = None,
+                       validation: Optional["Future[Optional[str]]"] = None,
+                       semantic_cache: Optional[SemanticCache] = None, fan_out: Optional[FanOut] = None) -> List[Dict[str, str]]:
     """
     Start a conversation with the personal assistant.
 
     Args:
+        client (ChatClient): The client used to send requests.
         model_id (str): The ID of the OpenAI language model to use for the conversation.
         username (str): The name of the user initiating the conversation.
         system_name (str): The name of the personal assistant.
         system_commands (list[str]): Array of strings to give the language model as system commands
+        history_strategy (HistoryStrategy): How to compact the conversation sent with each request [default: send everything]
+        max_request_tokens (int): Hard limit on the tokens sent with each request [optional]
+        stream (bool): Print responses as they're generated, rather than once they're complete
+        transcript (TranscriptStore): Where to save each turn of the conversation as it happens [optional]
+        session_id (str): The session to resume, or the ID to save a new session under [default: a new timestamped ID]
+        validation (Future): Validation of the model running in the background, checked before the first request is sent [optional]
+        semantic_cache (SemanticCache): Where to look up answers to similar prompts before sending a request, & store responses [optional]
+        fan_out (FanOut): Send each prompt to several models at once, rather than just `model_id` [optional]
+
+    Returns:
+        List[Dict[str, str]]: The full conversation.
     """
-    messages = get_system_commands(system_name, system_commands)
+    if transcript is not None and session_id in transcript:
+        messages = transcript.load(session_id)
+        print(f"Resuming session '{session_id}' ({len(messages)} messages)")
+    else:
+        messages = get_system_commands(system_name, system_commands)
+        if transcript is not None:
+            session_id = transcript.start(session_id, system_name=system_name, model_id=model_id)
+            for message in messages:
+                transcript.append(session_id, message["role"], message["content"])
+
+    history = ConversationHistory(messages, history_strategy, max_request_tokens)
     pad = max(len(system_name), len(user_name)) + 2
 
     print_system_response(system_name, f"How can I help you {user_name}?", pad)
@@ -90,47 +173,148 @@ def start_conversation(model_id: str, user_name: str, system_name: str, system_c
 
             if not prompt or re.match(r'^((?:exit|quit|q)(\(\))?[;]?[\W]*)$', prompt, re.IGNORECASE):
                 break
-            elif re.match(r'^((?:help)(\(\))?[;]?[\W]*)$', prompt, re.IGNORECASE):
-                messages.append({"role": "user", "content": "How can you help me?"})
+
+            if validation is not None:
+                error, validation = validation.result(), None
+                if error:
+                    print('\033[31m' + f"\nError: {error}" + '\033[0m')
+                    break
+
+            if re.match(r'^((?:help)(\(\))?[;]?[\W]*)$', prompt, re.IGNORECASE):
+                history.append("user", "How can you help me?")
             else:
-                messages.append({"role": "user", "content": prompt})
+                history.append("user", prompt)
+
+            try:
+                started = time.monotonic()
+                # the cache is keyed on the whole conversation rather than what's sent, so it doesn't depend on the history strategy
+                response_content = semantic_cache.get(model_id, history.messages) if semantic_cache is not None else None
+
+                if response_content is not None:
+                    print_system_response(system_name, response_content, pad)
+                    if client.telemetry is not None:
+                        client.telemetry.record(model_id, "cache", time.monotonic() - started, tags={"kind": "chat", "session": session_id})
+                elif fan_out is not None:
+                    results = fan_out.run(history.get_request_messages(), {"kind": "chat", "session": session_id})
+                    for result in results:
+                        print_system_response(f"{system_name} ({result.name}, {result.wall:.1f}s)",
+                                              result.content if result.error is None else f"Error: {result.error}", pad)
+                    # the conversation carries on from the first model that responded, in the order they're configured
+                    response_content = next(result.content for result in results if result.error is None)
+
+                    if semantic_cache is not None:
+                        semantic_cache.put(model_id, history.messages, response_content)
+                else:
+                    response = client.create(
+                        model=model_id,
+                        messages=history.get_request_messages(),
+                        stream=stream,
+                        tags={"kind": "chat", "session": session_id}
+                    )
 
-            response = openai.ChatCompletion.create(
-                model=model_id,
-                messages=messages
-            )
+                    if stream:
+                        response_content = print_system_response_stream(system_name, stream_content(response), pad)
+                    else:
+                        response_content = response['choices'][0]['message']['content'] # type: ignore
+                        print_system_response(system_name, response_content, pad)
 
-            response_content = response['choices'][0]['message']['content'] # type: ignore
-            messages.append({"role": "assistant", "content": response_content})
-            print_system_response(system_name, response_content, pad)
+                    if semantic_cache is not None:
+                        semantic_cache.put(model_id, history.messages, response_content)
+            except Exception as e:
+                if not is_api_error(e):
+                    raise
+                # the client has already retried anything transient, so drop this prompt & carry on
+                print('\033[31m' + f"\nError: {e}" + '\033[0m')
+                history.pop()
+                continue
 
+            history.append("assistant", response_content)
+
+            if transcript is not None:
+                for message in history.messages[-2:]:
+                    transcript.append(session_id, message["role"], message["content"])
 
     except (KeyboardInterrupt, SystemExit):
         print('\033[31m' + "\nExiting..." + '\033[0m')
     except Exception as e:
         print('\033[31m' + f"\nError: {e}" + '\033[0m')
     finally:
-        return messages
+        return history.messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat with your personal assistant.")
+    parser.add_argument("--session", help="name of the session to resume, or to save a new session under")
+    parser.add_argument("--list", action="store_true", help="list saved sessions")
+    parser.add_argument("--search", metavar="TEXT", help="list saved sessions whose name or title contains TEXT")
+    parser.add_argument("--skip-validation", action="store_true", help="don't check the model exists before sending the first request")
+    args = parser.parse_args()
+
+    transcript_dir = config.get("transcript_dir", "transcripts")
+    transcript = TranscriptStore(transcript_dir) if transcript_dir else None
+
+    if args.list or args.search:
+        if transcript is None:
+            print("Error: transcript_dir is not set.")
+            exit(1)
+        print_sessions(transcript.search(args.search) if args.search else transcript.sessions())
+        exit(0)
+
+    if not sys.stdin.isatty():
+        exit(1)
 
+    from dotenv import load_dotenv
+    load_dotenv()
 
-if not sys.stdin.isatty():
-    exit(1)
+    backend = get_backend(config)
+    model_id = config.get("model_id", os.getenv("OPENAI_MODEL"))
 
-load_dotenv()
+    validate_config(backend)
 
-openai.api_key = config.get("api_key", os.getenv("OPENAI_KEY"))
-openai.organization = config.get("org_id", os.getenv("OPENAI_ORG"))
+    # check the model while the first prompt's being typed, rather than holding up startup
+    validation = None
+    if not args.skip_validation:
+        model_cache_path = config.get("model_cache", os.path.join("cache", "models.json"))
+        model_cache = ModelListCache(model_cache_path, config.get("model_cache_ttl", 86400)) if model_cache_path else None
+        validation = validate_model_in_background(backend, model_id, model_cache)
 
-model_id = config.get("model_id", os.getenv("OPENAI_MODEL"))
+    system_commands = config.get("system_commands")
+    sys_names = config.get("system_names", ["System"])
 
-validate_openai_config(model_id)
+    if transcript is not None and args.session in transcript:
+        # keep the persona the session was started with
+        system_name = transcript.get_meta(args.session).get("system_name", random.choice(sys_names))
+    else:
+        system_name = random.choice(sys_names)
+
+    username = config.get("user_name", "User")
+
+    trace_dir = config.get("trace_dir", os.path.join("cache", "traces"))
+    trace_path = os.path.join(trace_dir, f"assist-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl") if trace_dir else None
+    telemetry = Telemetry(trace_path, config.get("prices"))
+
+    client = ChatClient.from_config(config, backend, telemetry)
+    history_strategy = get_history_strategy(config, client, model_id)
+
+    try:
+        semantic_cache = get_semantic_cache(config)
+        fan_out = get_fan_out(config, telemetry)
+    except ValueError as e:
+        print(f"Error: {e}")
+        exit(1)
 
-system_commands = config.get("system_commands")
-sys_names = config.get("system_names", ["System"])
-system_name = random.choice(sys_names)
+    messages = start_conversation(client, model_id, username, system_name, system_commands, history_strategy,
+                                  config.get("max_request_tokens"), config.get("stream", True), transcript, args.session, validation,
+                                  semantic_cache, fan_out)
 
-username = config.get("user_name", "User")
+    if semantic_cache is not None:
+        print(f"Semantic cache: {semantic_cache.report()}")
+        semantic_cache.close()
+    if fan_out is not None:
+        print(fan_out.report())
+    if telemetry.records:
+        print(telemetry.report(group_by="endpoint" if fan_out is not None else None))
+    telemetry.close()
 
-# TODO:: load message history from saved convo
-messages = start_conversation(model_id, username, system_name, system_commands)
-# TODO:: save message history to json/jsonl
\ No newline at end of file
+if __name__ == "__main__":
+    main()
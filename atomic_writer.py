@@ -0,0 +1,66 @@
+import asyncio
+import os
+from concurrent.futures import Executor
+from typing import Callable, Optional, Tuple
+
+
+def write_atomic(path: str, content: bytes) -> None:
+    """
+    Writes `content` to a copy of `path` & swaps it in, so readers never see a partial file.
+
+    The copy is named for the process, so processes writing the same file at once don't write over each other's copy.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+class AtomicWriter:
+    """
+    Writes files queued by concurrent coroutines in the background.
+
+    Each file is queued fully rendered & written in one go with `write_atomic` on
+    `executor`, so rendering overlaps with whatever's queueing files, and a file
+    either has its previous or its new content, never part of it.
+    """
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.files = 0
+        self.bytes = 0
+        self._queue: "asyncio.Queue[Optional[Tuple[str, str, Optional[Callable[[], None]]]]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def write(self, path: str, content: str, on_written: Optional[Callable[[], None]] = None) -> None:
+        """
+        Queues `content` to be written to `path`, then calls `on_written` once it has been.
+        """
+        self._queue.put_nowait((path, content, on_written))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+
+            path, content, on_written = item
+            data = content.encode("utf-8")
+            await loop.run_in_executor(self.executor, write_atomic, path, data)
+            self.files += 1
+            self.bytes += len(data)
+
+            if on_written is not None:
+                on_written()
+
+    async def close(self) -> None:
+        """
+        Waits for the queued files to be written.
+        """
+        self._queue.put_nowait(None)
+        if self._task is not None:
+            await self._task
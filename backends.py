@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from atomic_writer import write_atomic
+
+# `openai` is only imported once it's used, as it's slow to import & not needed by every backend
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+
+class ModelListCache:
+    """
+    The models listed by each backend, cached in a JSON file for `ttl` seconds.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400):
+        self.path = path
+        self.ttl = ttl
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        Returns the cached models for `key`, or `None` if there aren't any or they've expired.
+        """
+        entry = self._load().get(key)
+        if entry is None or time.time() - entry["fetched"] > self.ttl:
+            return None
+        return entry["models"]
+
+    def put(self, key: str, models: List[str]) -> None:
+        entries = self._load()
+        entries[key] = {"fetched": time.time(), "models": models}
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        write_atomic(self.path, json.dumps(entries).encode("utf-8"))
+
+
+class ModelBackend:
+    """
+    Where chat completions are sent; responses (and streamed chunks) are shaped like the OpenAI API's.
+    """
+
+    def get_config_errors(self) -> List[str]:
+        """
+        Returns the problems with the backend's settings, if any.
+        """
+        return []
+
+    @property
+    def cache_key(self) -> str:
+        """
+        Identifies the backend's list of models in a `ModelListCache`.
+        """
+        return type(self).__name__
+
+    def list_models(self) -> List[str]:
+        raise NotImplementedError
+
+    def is_valid_model(self, model_id: str, cache: Optional[ModelListCache] = None) -> bool:
+        """
+        Checks `model_id` is one of the backend's models, using the cached list of models if there is one
+        (it's only fetched again if it's expired, or doesn't include `model_id`).
+        """
+        models = cache.get(self.cache_key) if cache is not None else None
+        if models is None or model_id not in models:
+            models = self.list_models()
+            if cache is not None:
+                cache.put(self.cache_key, models)
+        return model_id in models
+
+    def create(self, model: str, messages: List[Dict[str, str]], **kwargs) -> Any:
+        """
+        Creates a chat completion, see `openai.ChatCompletion.create`.
+        """
+        raise NotImplementedError
+
+
+class OpenAIBackend(ModelBackend):
+    """
+    Sends requests to the OpenAI API, or to `api_base` if it's set.
+    """
+
+    def __init__(self, api_key: Optional[str], organization: Optional[str], api_base: Optional[str] = None):
+        self.api_key = api_key
+        self.organization = organization
+        self.api_base = api_base
+
+    def get_config_errors(self) -> List[str]:
+        errors = []
+        if self.organization is None:
+            errors.append("org_id is not set.")
+        if self.api_key is None:
+            errors.append("api_key is not set.")
+        return errors
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.api_base or DEFAULT_API_BASE} {self.organization or ''}".strip()
+
+    def get_request_options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"api_key": self.api_key, "organization": self.organization}
+        if self.api_base:
+            options["api_base"] = self.api_base
+        return options
+
+    def list_models(self) -> List[str]:
+        import openai
+        response = openai.Model.list(**self.get_request_options())
+        return [model['id'] for model in response['data']] if response is not None else [] # type: ignore
+
+    def create(self, model: str, messages: List[Dict[str, str]], **kwargs) -> Any:
+        import openai
+        return openai.ChatCompletion.create(model=model, messages=messages, **self.get_request_options(), **kwargs)
+
+
+class OpenAICompatibleBackend(OpenAIBackend):
+    """
+    Sends requests to any server implementing the OpenAI chat completions API at `api_base`,
+    e.g. a local llama.cpp or vLLM server; an API key & organization are optional.
+    """
+
+    def __init__(self, api_base: str, api_key: Optional[str] = None, organization: Optional[str] = None):
+        # the openai module refuses to send a request without a key, even if the server doesn't need one
+        super().__init__(api_key or "none", organization, api_base)
+
+    def get_config_errors(self) -> List[str]:
+        return [] if self.api_base else ["api_base is not set."]
+
+
+class FakeBackend(ModelBackend):
+    """
+    Answers in-process with deterministic placeholder content (the same as `mock_openai_server.py`),
+    after waiting `latency` seconds, for tests & benchmarks. Any model ID is accepted.
+
+    Args:
+        latency (float): Seconds to wait before answering each request.
+        jitter (float): Up to this many seconds are added to each wait, derived from the request's messages so the same request always waits as long.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+
+    def list_models(self) -> List[str]:
+        return ["fake"]
+
+    def is_valid_model(self, model_id: str, cache: Optional[ModelListCache] = None) -> bool:
+        return True
+
+    def create(self, model: str, messages: List[Dict[str, str]], **kwargs) -> Any:
+        from mock_openai_server import chat_completion
+
+        delay = self.get_delay(messages)
+        if delay:
+            time.sleep(delay)
+
+        response = chat_completion(model, messages)
+        return self.stream(response) if kwargs.get("stream") else response
+
+    def get_delay(self, messages: List[Dict[str, str]]) -> float:
+        if not self.jitter:
+            return self.latency
+        seed = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).digest()
+        return self.latency + random.Random(seed).uniform(0, self.jitter)
+
+    def stream(self, response: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        content = response["choices"][0]["message"]["content"]
+        for piece in re.findall(r"\S+\s*", content):
+            yield {"id": response["id"], "object": "chat.completion.chunk", "model": response["model"],
+                   "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+
+
+def get_backend(config: Dict[str, Any]) -> ModelBackend:
+    """
+    Creates the backend selected by `backend` in the config.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    name = config.get("backend", "openai")
+    api_key = config.get("api_key", os.getenv("OPENAI_KEY"))
+    organization = config.get("org_id", os.getenv("OPENAI_ORG"))
+
+    if name == "openai":
+        return OpenAIBackend(api_key, organization, config.get("api_base"))
+    elif name == "openai_compatible":
+        return OpenAICompatibleBackend(config.get("api_base"), config.get("api_key"), config.get("org_id"))
+    elif name == "fake":
+        return FakeBackend(config.get("fake_latency", 0.0), config.get("fake_jitter", 0.0))
+
+    raise ValueError(f"Unknown backend '{name}', expected one of: openai, openai_compatible, fake")
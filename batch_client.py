@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from backends import DEFAULT_API_BASE, ModelBackend, OpenAIBackend
+from chat_client import UsageStats
+from completion_cache import get_cache_key
+
+# statuses a batch won't move on from
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchError(Exception):
+    """
+    Raised when a batch, or a request within one, fails.
+    """
+
+
+class BatchClient:
+    """
+    Runs chat completions through the provider's Batch API.
+
+    Requests are written to a JSONL file in `batch_dir`, uploaded & submitted as a batch
+    job, which is then polled every `poll_interval` seconds until it finishes. Batches
+    are billed at a discount but can take up to `completion_window` to complete, so
+    they're only worth it for offline bulk jobs.
+
+    Point `api_base` at a local server (see `mock_openai_server.py`) to run without the network.
+    """
+
+    def __init__(self,
+                 api_base: str,
+                 api_key: Optional[str],
+                 organization: Optional[str] = None,
+                 batch_dir: str = "batches",
+                 poll_interval: float = 30.0,
+                 completion_window: str = "24h",
+                 request_timeout: Optional[float] = 120):
+        self.api_base = api_base.rstrip("/")
+        self.api_key = api_key
+        self.organization = organization
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.request_timeout = request_timeout
+        self.usage = UsageStats()
+        self._count = 0
+
+        if not os.path.exists(batch_dir):
+            os.makedirs(batch_dir)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], backend: ModelBackend) -> "BatchClient":
+        """
+        Creates a client that sends batches to the same API as `backend`.
+
+        Raises:
+            ValueError: If the backend isn't an OpenAI (or OpenAI-compatible) API.
+        """
+        if not isinstance(backend, OpenAIBackend):
+            raise ValueError("batch is only supported by the openai or openai_compatible backend.")
+
+        return cls(
+            api_base=backend.api_base or DEFAULT_API_BASE,
+            api_key=backend.api_key,
+            organization=backend.organization,
+            batch_dir=config.get("batch_dir", os.path.join("cache", "batches")),
+            poll_interval=config.get("batch_poll_interval", 30),
+            request_timeout=config.get("request_timeout", 120),
+        )
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        return headers
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        response = requests.request(method, f"{self.api_base}{path}", headers=self._headers(), timeout=self.request_timeout, **kwargs)
+        if not response.ok:
+            raise BatchError(f"{method} {path} failed: {response.status_code} {response.text}")
+        return response
+
+    def write_batch(self, requests_by_id: Dict[str, Tuple[str, List[Dict[str, str]], Dict[str, Any]]]) -> str:
+        """
+        Writes the requests to a new batch input file.
+
+        Args:
+            requests_by_id (Dict[str, Tuple[str, List[Dict[str, str]], Dict[str, Any]]]): The model ID, messages & any other parameters
+                                                                           (e.g. `temperature`) of each request, by custom ID.
+
+        Returns:
+            str: The path of the batch file.
+        """
+        self._count += 1
+        path = os.path.join(self.batch_dir, f"batch-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{self._count}.jsonl")
+
+        with open(path, "w", encoding="utf-8") as f:
+            for custom_id, (model_id, messages, params) in requests_by_id.items():
+                line = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": model_id, "messages": messages, **params},
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+        return path
+
+    def submit(self, path: str) -> Dict[str, Any]:
+        """
+        Uploads a batch input file & starts a batch job for it.
+
+        Returns:
+            Dict[str, Any]: The batch job.
+        """
+        with open(path, "rb") as f:
+            upload = self._request("POST", "/files", files={"file": (os.path.basename(path), f)}, data={"purpose": "batch"}).json()
+
+        return self._request("POST", "/batches", json={
+            "input_file_id": upload["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": self.completion_window,
+        }).json()
+
+    def wait(self, batch_id: str) -> Dict[str, Any]:
+        """
+        Polls a batch job until it's finished.
+
+        Returns:
+            Dict[str, Any]: The finished batch job.
+        """
+        while True:
+            batch = self._request("GET", f"/batches/{batch_id}").json()
+            counts = batch.get("request_counts") or {}
+            print(f"Batch {batch_id}: {batch['status']} ({counts.get('completed', 0)}/{counts.get('total', '?')})")
+
+            if batch["status"] in FINISHED_STATUSES:
+                return batch
+
+            time.sleep(self.poll_interval)
+
+    def download(self, file_id: str, path: str) -> List[Dict[str, Any]]:
+        """
+        Downloads a batch output (or error) file to `path`, and returns its entries.
+        """
+        content = self._request("GET", f"/files/{file_id}/content").content
+
+        with open(path, "wb") as f:
+            f.write(content)
+
+        return [json.loads(line) for line in content.decode("utf-8").splitlines() if line.strip()]
+
+    def run(self, requests_by_id: Dict[str, Tuple[str, List[Dict[str, str]], Dict[str, Any]]]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]:
+        """
+        Runs a batch of requests to completion.
+
+        Args:
+            requests_by_id (Dict[str, Tuple[str, List[Dict[str, str]], Dict[str, Any]]]): The model ID, messages & any other parameters
+                                                                           (e.g. `temperature`) of each request, by custom ID.
+
+        Returns:
+            Tuple[Dict[str, Dict[str, Any]], Dict[str, str]]: The response (chat completion) of each successful request,
+                                                              and the error of each failed one, by custom ID.
+
+        Raises:
+            BatchError: If the batch can't be submitted or polled.
+        """
+        path = self.write_batch(requests_by_id)
+        batch = self.submit(path)
+        print(f"Submitted batch {batch['id']} of {len(requests_by_id)} requests ({path})")
+
+        batch = self.wait(batch["id"])
+        base_path = os.path.splitext(path)[0]
+
+        entries = []
+        if batch.get("output_file_id"):
+            entries += self.download(batch["output_file_id"], f"{base_path}-output.jsonl")
+        if batch.get("error_file_id"):
+            entries += self.download(batch["error_file_id"], f"{base_path}-errors.jsonl")
+
+        results: Dict[str, Dict[str, Any]] = {}
+        errors: Dict[str, str] = {}
+
+        for entry in entries:
+            custom_id = entry["custom_id"]
+            response = entry.get("response") or {}
+            if entry.get("error") or response.get("status_code") != 200:
+                errors[custom_id] = json.dumps(entry.get("error") or response.get("body"))
+            else:
+                results[custom_id] = response["body"]
+                self.usage.record(response["body"].get("usage"))
+
+        for custom_id in requests_by_id:
+            if custom_id not in results and custom_id not in errors:
+                errors[custom_id] = f"no result (batch {batch['status']})"
+
+        return results, errors
+
+
+class AsyncBatcher:
+    """
+    Collects the requests made by concurrent coroutines into batches.
+
+    A batch is sent once no new requests have arrived for `window` seconds, i.e. once
+    everything that can make progress is waiting on a response, so each level of a
+    dependency graph goes in a single batch. Identical requests are only sent once.
+    """
+
+    def __init__(self, client: BatchClient, executor: Executor, window: float = 0.5):
+        self.client = client
+        self.executor = executor
+        self.window = window
+        self._pending: Dict[str, Tuple[str, List[Dict[str, str]], Dict[str, Any], List[asyncio.Future]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def submit(self, model_id: str, messages: List[Dict[str, str]], **params) -> Dict[str, Any]:
+        """
+        Adds a request to the next batch, and returns its response (chat completion) once the batch has finished.
+
+        Args:
+            model_id (str): The model to send the request to.
+            messages (List[Dict[str, str]]): The messages to send.
+            **params: Any other parameters of the request, e.g. `temperature` or `max_tokens`.
+
+        Raises:
+            BatchError: If the request, or its batch, fails.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        # requests that only differ by their parameters aren't identical
+        key = get_cache_key(model_id, messages + [params]) if params else get_cache_key(model_id, messages)
+        self._pending.setdefault(key, (model_id, messages, params, []))[3].append(future)
+
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+
+        return await future
+
+    async def _flush(self) -> None:
+        # wait until requests stop arriving
+        while True:
+            count = len(self._pending)
+            await asyncio.sleep(self.window)
+            if len(self._pending) == count:
+                break
+
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+
+        try:
+            loop = asyncio.get_running_loop()
+            results, errors = await loop.run_in_executor(
+                self.executor, self.client.run, {key: (model_id, messages, params) for key, (model_id, messages, params, _) in pending.items()})
+        except Exception as e:
+            results, errors = {}, {key: str(e) for key in pending}
+
+        # resolve the successes first, so they're cached even if a failure ends the run
+        for key, response in results.items():
+            for future in pending[key][3]:
+                if not future.done():
+                    future.set_result(response)
+
+        for key, error in errors.items():
+            for future in pending[key][3]:
+                if not future.done():
+                    future.set_exception(BatchError(error))
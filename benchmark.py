@@ -0,0 +1,264 @@
+import argparse
+import builtins
+import contextlib
+import importlib.util
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from backends import FakeBackend, ModelBackend, ModelListCache
+from mock_openai_server import MockHandler, MockState
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FIXTURE = os.path.join(ROOT, "data", "benchmark", "OWASP.Application.Security.Verification.Standard.4.0.3-en.json")
+GENERATOR = os.path.join(ROOT, "Projects", "ASVS", "generate-asvs-guide.py")
+SCENARIOS = ["generate", "regenerate", "variants", "assist"]
+
+# the `guides` generated by the `variants` scenario, which only differ by the tech stack examples assume
+VARIANTS = [{"tech_stack": "Python web application using Django"}, {"tech_stack": "Node.js web application using Express"},
+            {"tech_stack": "Java web application using Spring Boot"}]
+
+# the assist scenario asks these in turn, so later turns repeat earlier questions
+QUESTIONS = [
+    "How should I test the session management of our API?",
+    "What's the quickest way to check our cookies are set securely?",
+    "How do I make sure password reset tokens can't be guessed?",
+    "Which headers should every response from our web app include?",
+    "How can I tell if our file uploads are vulnerable to path traversal?",
+]
+
+SYSTEM_COMMANDS = [
+    "You are an expert in Software Development & Testing, incl. Application Security Testing.",
+    "Act as a technical author.",
+    "All responses should be in British English and output in Markdown format compatible with GitHub's implementation of markdown.",
+]
+
+
+class MeteredBackend(ModelBackend):
+    """
+    Passes requests on to `backend`, measuring how many are in flight at once.
+    """
+
+    def __init__(self, backend: ModelBackend):
+        self.backend = backend
+        self.requests = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def list_models(self) -> List[str]:
+        return self.backend.list_models()
+
+    def is_valid_model(self, model_id: str, cache: Optional[ModelListCache] = None) -> bool:
+        return self.backend.is_valid_model(model_id, cache)
+
+    def create(self, model: str, messages: List[Dict[str, str]], **kwargs) -> Any:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+
+        started = time.monotonic()
+        try:
+            return self.backend.create(model, messages, **kwargs)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.busy += time.monotonic() - started
+
+
+def serve_fixture(path: str) -> ThreadingHTTPServer:
+    """
+    Serves `path` as the latest ASVS release on a free local port, so it's fetched the same way as the real one.
+    """
+    MockHandler.state = MockState([], asvs_files=[path])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_config(args: argparse.Namespace, **config) -> Dict[str, Any]:
+    config = {
+        "backend": "fake",
+        "model_id": "fake",
+        "fake_latency": args.latency,
+        "fake_jitter": args.jitter,
+        "max_concurrent_requests": args.concurrency,
+        "system_commands": SYSTEM_COMMANDS,
+        "completion_cache": None,
+        "trace_dir": None,
+        **config,
+    }
+    with open("config.json", "w") as f:
+        json.dump(config, f, indent=4)
+    return config
+
+
+def load_module(name: str, path: str):
+    # both scripts read `config.json` from the working directory when they're imported
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def count_files(directory: str, since: float = 0.0) -> int:
+    return sum(1 for parent, _, files in os.walk(directory) for file in files if os.path.getmtime(os.path.join(parent, file)) >= since)
+
+
+def run_generate(args: argparse.Namespace, work_dir: str, runs: int, guides: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fetches the fixture & generates each of `guides` from it `runs` times, measuring the last run (so `runs=2`
+    measures an incremental re-run with the requirements & every file already in place).
+    """
+    server = serve_fixture(FIXTURE)
+    config = write_config(args, asvs_release_url=f"http://127.0.0.1:{server.server_address[1]}/repos/OWASP/ASVS/releases/latest")
+    generator = load_module("generate_asvs_guide", GENERATOR)
+
+    try:
+        for _ in range(runs):
+            backend = MeteredBackend(FakeBackend(args.latency, args.jitter))
+            started_at = time.time()
+            started = time.monotonic()
+
+            http = generator.HttpCache(os.path.join("cache", "downloads"))
+            try:
+                fetched = [(guide, generator.fetch_asvs_requirements(http, os.path.join("cache", "requirements"), config["asvs_release_url"]))
+                           for guide in guides]
+            finally:
+                http.close()
+            generator.create_directory_structure_and_files(work_dir, fetched, "testing-guide", backend)
+
+            wall = time.monotonic() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {"wall": wall, "backend": backend, "files": count_files(os.path.join(work_dir, "testing-guide"), started_at)}
+
+
+def run_assist(args: argparse.Namespace, work_dir: str) -> Dict[str, Any]:
+    """
+    Holds a conversation of `args.turns` scripted prompts with the assistant, streaming each response & saving the transcript
+    (& with `--semantic-cache`, answering repeated prompts from the semantic cache).
+    """
+    config = write_config(args, history_strategy="summarise", semantic_cache=os.path.join("cache", "semantic.json") if args.semantic_cache else None)
+    assist = load_module("assist", os.path.join(ROOT, "assist.py"))
+
+    backend = MeteredBackend(FakeBackend(args.latency, args.jitter))
+    client = assist.ChatClient.from_config(config, backend)
+    transcript = assist.TranscriptStore(os.path.join(work_dir, "transcripts"))
+    semantic_cache = assist.get_semantic_cache(config)
+    prompts = iter([QUESTIONS[turn % len(QUESTIONS)] for turn in range(args.turns)] + ["exit"])
+
+    started_at = time.time()
+    started = time.monotonic()
+    with scripted_input(lambda prompt="": next(prompts)):
+        assist.start_conversation(client, config["model_id"], "User", "Bot", SYSTEM_COMMANDS, assist.get_history_strategy(config, client, config["model_id"]),
+                                  transcript=transcript, session_id="benchmark", semantic_cache=semantic_cache)
+    wall = time.monotonic() - started
+
+    return {"wall": wall, "backend": backend, "files": count_files(os.path.join(work_dir, "transcripts"), started_at)}
+
+
+@contextlib.contextmanager
+def scripted_input(replacement):
+    original = builtins.input
+    builtins.input = replacement
+    try:
+        yield
+    finally:
+        builtins.input = original
+
+
+def run_scenario(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Runs `scenario` in a new temporary directory, returning its measurements.
+    """
+    with tempfile.TemporaryDirectory(prefix="asvs-benchmark-") as work_dir:
+        os.chdir(work_dir)
+        # the scripts report their progress as they go, which isn't what's being measured
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if scenario == "assist":
+                result = run_assist(args, work_dir)
+            else:
+                result = run_generate(args, work_dir, 2 if scenario == "regenerate" else 1, VARIANTS if scenario == "variants" else [{}])
+        os.chdir(ROOT)
+
+    backend: MeteredBackend = result.pop("backend")
+    wall = result["wall"]
+    return {
+        "scenario": scenario,
+        "wall": round(wall, 3),
+        "requests": backend.requests,
+        "peak_concurrency": backend.peak,
+        "mean_concurrency": round(backend.busy / wall, 2) if wall > 0 else 0.0,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "files": result["files"],
+        "files_per_second": round(result["files"] / wall, 1) if wall > 0 else 0.0,
+    }
+
+
+def summarise(results: List[Dict[str, Any]]) -> str:
+    walls = [result["wall"] for result in results]
+    median = {key: statistics.median(result[key] for result in results)
+              for key in ("requests", "peak_concurrency", "mean_concurrency", "peak_rss_mb", "files", "files_per_second")}
+    return (f"{results[0]['scenario']:<10} wall {statistics.median(walls):.2f}s (min {min(walls):.2f}s, max {max(walls):.2f}s), "
+            f"{median['requests']:.0f} requests, concurrency peak {median['peak_concurrency']:.0f} / mean {median['mean_concurrency']:.2f}, "
+            f"peak RSS {median['peak_rss_mb']:.1f} MB, {median['files']:.0f} files ({median['files_per_second']:.1f} files/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ASVS guide generator & the assistant offline, against a bundled ASVS "
+                                                 "fixture & a deterministic fake model.")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"any of {', '.join(SCENARIOS)} [default: all]; generate: a guide from scratch, regenerate: an unchanged "
+                             f"guide again, variants: {len(VARIANTS)} guides for different tech stacks at once, assist: a scripted conversation")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times to run each scenario, each in a new process")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the fake model takes to answer each request")
+    parser.add_argument("--jitter", type=float, default=0.05, help="up to this many seconds are added to each request's latency")
+    parser.add_argument("--concurrency", type=int, default=8, help="max_concurrent_requests for the generator")
+    parser.add_argument("--turns", type=int, default=20, help="number of prompts in the assist conversation")
+    parser.add_argument("--semantic-cache", action="store_true", help="enable the semantic cache for the assist conversation")
+    parser.add_argument("--json", action="store_true", help="print each run's measurements as JSON lines")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario '{scenario}', expected one of: {', '.join(SCENARIOS)}")
+    args.scenarios = args.scenarios or SCENARIOS
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args)))
+        return
+
+    options = ["--latency", str(args.latency), "--jitter", str(args.jitter), "--concurrency", str(args.concurrency), "--turns", str(args.turns)]
+    if args.semantic_cache:
+        options.append("--semantic-cache")
+    print(f"latency {args.latency}s + up to {args.jitter}s jitter, concurrency {args.concurrency}, {args.repeat} runs each")
+
+    for scenario in args.scenarios:
+        results = []
+        for _ in range(args.repeat):
+            # a new process per run, so peak RSS & imports aren't carried over from the last one
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", scenario, *options],
+                                    cwd=ROOT, capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            results.append(result)
+            if args.json:
+                print(json.dumps(result))
+        print(summarise(results))
+
+if __name__ == "__main__":
+    main()
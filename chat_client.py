@@ -0,0 +1,276 @@
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from backends import ModelBackend
+from telemetry import Telemetry
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    Estimates the number of prompt tokens in `messages`.
+
+    Uses the rule of thumb of ~4 characters per token, plus the few tokens of
+    overhead each message adds for its role & separators.
+
+    Args:
+        messages (List[Dict[str, str]]): The messages to be sent.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return sum(4 + len(message.get("content") or "") // 4 for message in messages) + 3
+
+
+def stream_content(chunks: Iterable[Any]) -> Iterator[str]:
+    """
+    Yields the content deltas of a streamed chat completion (i.e. one created with `stream=True`).
+    """
+    for chunk in chunks:
+        if not chunk['choices']:
+            continue
+        content = chunk['choices'][0].get('delta', {}).get('content')
+        if content:
+            yield content
+
+
+class UsageStats:
+    """
+    Thread-safe running totals of the token usage reported by responses, incl. how many
+    prompt tokens were served from the provider's prompt (prefix) cache.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, usage: Optional[Dict[str, Any]]) -> None:
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.cached_tokens += details.get("cached_tokens") or 0
+            self.completion_tokens += usage.get("completion_tokens") or 0
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def report(self) -> str:
+        return f"{self.requests} requests, {self.prompt_tokens} prompt tokens " \
+               f"({self.cached_tokens} cached, {self.prompt_tokens - self.cached_tokens} uncached, {self.cache_hit_ratio:.0%} hit ratio), " \
+               f"{self.completion_tokens} completion tokens"
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket holding up to `capacity` tokens, refilled evenly over `period` seconds.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1) -> None:
+        """
+        Blocks until `amount` tokens are available, then takes them.
+        """
+        # a request larger than the bucket would never fit, so let it through once the bucket is full
+        amount = min(amount, self.capacity)
+
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def refund(self, amount: float) -> None:
+        """
+        Returns `amount` tokens to the bucket, or takes more if `amount` is negative (e.g. once
+        the actual usage of a request is known).
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    for name, value in headers.items():
+        if name.lower() == "retry-after":
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def is_api_error(error: Exception) -> bool:
+    # `openai` is only imported by the backends that use it, so until then none of its errors can be raised
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, openai.error.OpenAIError)
+
+
+def is_retryable(error: Exception) -> bool:
+    if not is_api_error(error):
+        return False
+
+    import openai
+
+    # errors worth retrying: rate limits, timeouts, dropped connections & server side failures
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.APIConnectionError,
+                          openai.error.Timeout, openai.error.TryAgain)):
+        return True
+    status = getattr(error, "http_status", None)
+    return isinstance(error, openai.error.APIError) and status is not None and status >= 500
+
+
+class ChatClient:
+    """
+    Wraps a model backend's `create` with client side rate limiting, retries & timeouts.
+
+    Requests are held back until both the requests-per-minute & tokens-per-minute budgets
+    allow them (once per request, however many times it's retried, and a request that fails
+    gets its tokens back); transient failures are retried with jittered exponential backoff, waiting at
+    least as long as any `Retry-After` header asks for. The token usage of each response is
+    added to `usage`, and each call is recorded to `telemetry` if it's set.
+    """
+
+    def __init__(self,
+                 backend: ModelBackend,
+                 requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None,
+                 max_retries: int = 6,
+                 request_timeout: Optional[float] = 120,
+                 backoff_base: float = 1.0,
+                 backoff_max: float = 60.0,
+                 telemetry: Optional[Telemetry] = None):
+        self.backend = backend
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.usage = UsageStats()
+        self.telemetry = telemetry
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], backend: ModelBackend, telemetry: Optional[Telemetry] = None) -> "ChatClient":
+        return cls(
+            backend,
+            requests_per_minute=config.get("requests_per_minute"),
+            tokens_per_minute=config.get("tokens_per_minute"),
+            max_retries=config.get("max_retries", 6),
+            request_timeout=config.get("request_timeout", 120),
+            telemetry=telemetry,
+        )
+
+    def get_backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = get_retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def create(self, model: str, messages: List[Dict[str, str]], tags: Optional[Dict[str, Any]] = None, **kwargs) -> Any:
+        """
+        Creates a chat completion, see `openai.ChatCompletion.create`.
+
+        With `stream=True` only the initial request is retried, and the chunks are returned as they arrive.
+
+        Args:
+            tags (Dict[str, Any]): What the call is for, added to its telemetry record [optional].
+
+        Raises:
+            Exception: The backend's error if the request fails with a non-retryable error, or retries are exhausted.
+        """
+        if self.request_timeout is not None:
+            kwargs.setdefault("request_timeout", self.request_timeout)
+
+        estimate = estimate_tokens(messages) + (kwargs.get("max_tokens") or 0)
+        attempt = 0
+        started = time.monotonic()
+        wait = 0.0
+
+        # reserved once for the request rather than for every attempt, as failed attempts aren't charged for their tokens,
+        # & the backoff between attempts already keeps retries from adding to a burst
+        waiting = time.monotonic()
+        if self.request_bucket:
+            self.request_bucket.acquire()
+        if self.token_bucket:
+            self.token_bucket.acquire(estimate)
+        wait += time.monotonic() - waiting
+
+        while True:
+            try:
+                response = self.backend.create(model, messages, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    if self.token_bucket:
+                        self.token_bucket.refund(estimate)
+                    if self.telemetry is not None:
+                        self.telemetry.record(model, "api", time.monotonic() - started, retries=attempt, wait=wait,
+                                              error=f"{type(e).__name__}: {e}", tags=tags)
+                    raise
+                delay = self.get_backoff(attempt, e)
+                attempt += 1
+                print(f"{type(e).__name__}: {e} - retrying in {delay:.1f}s ({attempt}/{self.max_retries})")
+                time.sleep(delay)
+                continue
+
+            usage = response.get("usage") if isinstance(response, dict) else None
+            self.usage.record(usage)
+            if self.token_bucket and usage and "total_tokens" in usage:
+                self.token_bucket.refund(estimate - usage["total_tokens"])
+
+            if self.telemetry is not None:
+                if kwargs.get("stream"):
+                    return self.trace_stream(response, model, messages, started, attempt, wait, tags)
+                self.telemetry.record(model, "api", time.monotonic() - started, usage=usage, retries=attempt, wait=wait, tags=tags)
+
+            return response
+
+    def trace_stream(self, chunks: Iterable[Any], model: str, messages: List[Dict[str, str]], started: float,
+                     retries: int, wait: float, tags: Optional[Dict[str, Any]]) -> Iterator[Any]:
+        """
+        Passes on the chunks of a streamed response, recording it to `telemetry` once it's complete.
+
+        Streamed responses don't include their usage, so it's estimated from the messages & the content received.
+        """
+        ttft = None
+        content = []
+        error = None
+        try:
+            for chunk in chunks:
+                if ttft is None:
+                    ttft = time.monotonic() - started
+                if chunk['choices']:
+                    content.append(chunk['choices'][0].get('delta', {}).get('content') or "")
+                yield chunk
+        except GeneratorExit:
+            # closed before it's complete, e.g. it lost a fan-out race
+            error = "cancelled"
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            usage = {"prompt_tokens": estimate_tokens(messages), "completion_tokens": len("".join(content)) // 4}
+            self.telemetry.record(model, "api", time.monotonic() - started, ttft, usage, retries, wait, error, tags) # type: ignore
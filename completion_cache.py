@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+
+def get_cache_key(model_id: str, messages: List[Dict[str, str]]) -> str:
+    """
+    Returns a stable key for a completion request.
+
+    Args:
+        model_id (str): The ID of the model the request is sent to.
+        messages (List[Dict[str, str]]): The full list of messages sent.
+
+    Returns:
+        str: The hex encoded SHA-256 of the model ID & messages.
+    """
+    payload = json.dumps([model_id, messages], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    An append-only JSONL store of completed requests.
+
+    Each line holds the key of a request (see `get_cache_key`), the model, the final
+    prompt & the response content. Entries are only ever appended, so a crash can
+    at worst leave a truncated final line, which is ignored on the next load.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._entries[entry["key"]] = entry["content"]
+
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, model_id: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        with self._lock:
+            content = self._entries.get(get_cache_key(model_id, messages))
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return content
+
+    def put(self, model_id: str, messages: List[Dict[str, str]], content: str) -> None:
+        key = get_cache_key(model_id, messages)
+        prompt = messages[-1]["content"] if messages else ""
+        line = json.dumps({"key": key, "model": model_id, "prompt": prompt, "content": content}, ensure_ascii=False)
+
+        with self._lock:
+            self._entries[key] = content
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,195 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from backends import get_backend
+from chat_client import ChatClient, stream_content
+from telemetry import Telemetry, percentile
+
+POLICIES = ["race", "compare"]
+
+
+@dataclass
+class Contender:
+    """
+    A model, and the endpoint it's served from, that each prompt is sent to.
+    """
+    name: str
+    model_id: str
+    client: ChatClient
+    fastest: int = 0
+    cancelled: int = 0
+    errors: int = 0
+    walls: List[float] = field(default_factory=list)
+    # how long each cancelled request had been running without a response, i.e. a lower bound on its latency
+    cancelled_walls: List[float] = field(default_factory=list)
+
+
+def format_latency(walls: List[float]) -> str:
+    if not walls:
+        return "p50 n/a, p95 n/a"
+    return f"p50 {percentile(walls, 50):.2f}s, p95 {percentile(walls, 95):.2f}s"
+
+
+@dataclass
+class FanOutResult:
+    name: str
+    model_id: str
+    content: Optional[str]
+    wall: float
+    error: Optional[Exception] = None
+
+
+class FanOut:
+    """
+    Sends each prompt to several models (or endpoints) at once.
+
+    With the `race` policy the first complete response wins, and the other requests are cancelled: their
+    streams are closed, so they stop generating (a request that hasn't started responding yet is closed as
+    soon as it does). With `compare` every response is waited for, so they can be shown together.
+
+    Either way, each model's latency & how often it was the fastest is kept, see `report`; a request that's
+    cancelled records how long it had been running as a lower bound on its latency.
+
+    Args:
+        contenders (List[Contender]): The models to send each prompt to.
+        policy (str): `race` or `compare`.
+    """
+
+    def __init__(self, contenders: List[Contender], policy: str = "race"):
+        self.contenders = contenders
+        self.policy = policy
+        self.prompts = 0
+        self._lock = threading.Lock()
+
+    def ask(self, contender: Contender, messages: List[Dict[str, str]], tags: Dict[str, Any], done: threading.Event,
+            results: "queue.Queue[FanOutResult]") -> None:
+        started = time.monotonic()
+        try:
+            # always streamed, so a request that's lost the race can be cut off part way through
+            chunks = contender.client.create(model=contender.model_id, messages=messages, stream=True,
+                                             tags={**tags, "endpoint": contender.name})
+            content = []
+            try:
+                for piece in stream_content(chunks):
+                    if done.is_set():
+                        return
+                    content.append(piece)
+            finally:
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+        except Exception as e:
+            # counted by `run`, unless the race has already been decided, when it only counts as cancelled
+            results.put(FanOutResult(contender.name, contender.model_id, None, time.monotonic() - started, e))
+            return
+
+        wall = time.monotonic() - started
+        with self._lock:
+            # one that finished just after the race was decided still counts as cancelled
+            if not done.is_set():
+                contender.walls.append(wall)
+        results.put(FanOutResult(contender.name, contender.model_id, "".join(content), wall))
+
+    def run(self, messages: List[Dict[str, str]], tags: Optional[Dict[str, Any]] = None) -> List[FanOutResult]:
+        """
+        Sends `messages` to every contender at once.
+
+        Returns:
+            List[FanOutResult]: With `race`, the first complete response; with `compare`, every contender's
+                                response (or error), in the order they're configured.
+
+        Raises:
+            Exception: The first contender's error, if none of them responded.
+        """
+        done = threading.Event()
+        results: "queue.Queue[FanOutResult]" = queue.Queue()
+        # daemon threads, so a cancelled request that's still waiting on its first chunk never holds up exiting
+        for contender in self.contenders:
+            threading.Thread(target=self.ask, args=(contender, messages, tags or {}, done, results), daemon=True).start()
+
+        started = time.monotonic()
+        received: List[FanOutResult] = []
+        winner = None
+        while len(received) < len(self.contenders):
+            result = results.get()
+            received.append(result)
+            if result.error is None and winner is None:
+                winner = result
+                if self.policy == "race":
+                    done.set()
+                    break
+
+        with self._lock:
+            self.prompts += 1
+            if winner is not None:
+                next(contender for contender in self.contenders if contender.name == winner.name).fastest += 1
+            # the others are cut off as soon as they respond, having taken at least as long as the winner
+            finished = {result.name: result for result in received}
+            for contender in self.contenders:
+                if contender.name in finished:
+                    if finished[contender.name].error is not None:
+                        contender.errors += 1
+                else:
+                    contender.cancelled += 1
+                    contender.cancelled_walls.append(time.monotonic() - started)
+
+        if winner is None:
+            errors = {result.name: result.error for result in received}
+            raise errors[self.contenders[0].name] # type: ignore
+
+        if self.policy == "race":
+            return [winner]
+
+        order = [contender.name for contender in self.contenders]
+        return sorted(received, key=lambda result: order.index(result.name))
+
+    def report(self) -> str:
+        with self._lock:
+            lines = [f"Fan-out ({self.policy}) of {self.prompts} prompts to {len(self.contenders)} models:"]
+            for contender in self.contenders:
+                cancelled = f" after {format_latency(contender.cancelled_walls)}" if contender.cancelled_walls else ""
+                lines.append(f"  {contender.name}: fastest {contender.fastest} times, {len(contender.walls)} responses "
+                             f"{format_latency(contender.walls)}, {contender.cancelled} cancelled{cancelled}, {contender.errors} errors")
+        return "\n".join(lines)
+
+
+def get_fan_out(config: Dict[str, Any], telemetry: Optional[Telemetry] = None) -> Optional[FanOut]:
+    """
+    Creates a fan-out to the models in `fan_out` in the config, if it's set.
+
+    Each entry is either a model ID, sent to the configured backend, or an object with a `model_id` & any of the
+    backend settings (e.g. `backend`, `api_base`, `api_key` & `requests_per_minute`) that differ for it, plus an
+    optional `name` to report it by.
+
+    Raises:
+        ValueError: If the policy is unknown, or an entry is missing its `model_id`, has a duplicate name or an invalid backend.
+    """
+    entries = config.get("fan_out")
+    if not entries:
+        return None
+
+    policy = config.get("fan_out_policy", "race")
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown fan-out policy '{policy}', expected one of: {', '.join(POLICIES)}")
+
+    contenders: List[Contender] = []
+    for entry in entries:
+        entry = {"model_id": entry} if isinstance(entry, str) else entry
+        if not entry.get("model_id"):
+            raise ValueError(f"Fan-out entry {entry} has no `model_id`")
+
+        name = entry.get("name") or (f"{entry['model_id']} @ {entry['api_base']}" if entry.get("api_base") else entry["model_id"])
+        if any(contender.name == name for contender in contenders):
+            raise ValueError(f"More than one fan-out entry is called '{name}', give them each a different `name`")
+
+        entry_config = {**config, **entry}
+        backend = get_backend(entry_config)
+        for error in backend.get_config_errors():
+            raise ValueError(f"Fan-out entry '{name}': {error}")
+
+        contenders.append(Contender(name, entry["model_id"], ChatClient.from_config(entry_config, backend, telemetry)))
+
+    return FanOut(contenders, policy)
@@ -0,0 +1,193 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, Iterable, Iterator
+
+from chat_client import estimate_tokens
+from validators import RefusalValidator
+
+
+class DatasetStats:
+    """
+    Counts what happens to the pairs as they pass through the pipeline.
+    """
+
+    def __init__(self):
+        self.read = 0
+        self.invalid = 0
+        self.too_short = 0
+        self.too_long = 0
+        self.duplicates = 0
+        self.written = 0
+        self.shards = 0
+
+    def report(self) -> str:
+        return f"{self.read} pairs read, {self.invalid} invalid, {self.too_short} too short, {self.too_long} too long, " \
+               f"{self.duplicates} duplicates; {self.written} written to {self.shards} shards"
+
+
+def read_jsonl(path: str) -> Iterator[Dict]:
+    """
+    Yields each line of a JSONL file, skipping any that are truncated or corrupt.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def read_transcript_pairs(directory: str, stats: DatasetStats) -> Iterator[Dict[str, str]]:
+    """
+    Yields each user prompt & the assistant's answer to it from the conversations saved by `assist.py`.
+
+    Sessions are interleaved in the transcript log, so only the latest prompt of each session is held at once.
+    """
+    log_path = os.path.join(directory, "log.jsonl")
+    if not os.path.exists(log_path):
+        return
+
+    prompts: Dict[str, str] = {}
+    for entry in read_jsonl(log_path):
+        if entry["role"] == "user":
+            prompts[entry["session"]] = entry["content"]
+        elif entry["role"] == "assistant" and entry["session"] in prompts:
+            stats.read += 1
+            yield {"prompt": prompts.pop(entry["session"]), "completion": entry["content"]}
+
+
+def read_completion_pairs(path: str, stats: DatasetStats) -> Iterator[Dict[str, str]]:
+    """
+    Yields each prompt & response in a completion cache, e.g. the chapter, section & requirement prompts of the ASVS guide generator.
+    """
+    if not os.path.exists(path):
+        return
+
+    for entry in read_jsonl(path):
+        stats.read += 1
+        yield {"prompt": entry["prompt"], "completion": entry["content"]}
+
+
+def filter_pairs(pairs: Iterable[Dict[str, str]], stats: DatasetStats, min_tokens: int = 16, max_tokens: int = 4096) -> Iterator[Dict[str, str]]:
+    """
+    Yields the pairs that are valid responses & whose (estimated) prompt & completion tokens are between `min_tokens` & `max_tokens`.
+    """
+    refusal = RefusalValidator()
+    for pair in pairs:
+        completion = pair["completion"].strip()
+        if not completion or not refusal.check(completion):
+            stats.invalid += 1
+            continue
+
+        tokens = estimate_tokens([{"content": pair["prompt"]}, {"content": completion}])
+        if tokens < min_tokens:
+            stats.too_short += 1
+        elif tokens > max_tokens:
+            stats.too_long += 1
+        else:
+            yield pair
+
+
+def deduplicate(pairs: Iterable[Dict[str, str]], stats: DatasetStats) -> Iterator[Dict[str, str]]:
+    """
+    Yields the first of each pair with the same prompt & completion, ignoring case & whitespace.
+
+    Only a 16 byte digest of each pair is kept, rather than the pair itself.
+    """
+    seen = set()
+    for pair in pairs:
+        normalised = json.dumps([" ".join(pair["prompt"].lower().split()), " ".join(pair["completion"].lower().split())], ensure_ascii=False)
+        digest = hashlib.blake2b(normalised.encode("utf-8"), digest_size=16).digest()
+        if digest in seen:
+            stats.duplicates += 1
+            continue
+        seen.add(digest)
+        yield pair
+
+
+def write_shards(pairs: Iterable[Dict[str, str]], directory: str, stats: DatasetStats, shard_size: int = 1000) -> None:
+    """
+    Writes the pairs to `fine-tune-00000.jsonl`, `fine-tune-00001.jsonl`, ... in `directory`, `shard_size` to each,
+    in the format of `data/fine-tune_template.jsonl`.
+
+    The shards are written to a staging directory next to `directory`, which replaces it (& everything in it) once
+    every shard is complete; if the run fails, only the staging directory is removed, so `directory` keeps the
+    shards of the last run that succeeded.
+    """
+    directory = os.path.normpath(directory)
+    staging, previous = f"{directory}.tmp", f"{directory}.old"
+
+    # finish the swap of a run that was interrupted part way through it
+    if os.path.exists(previous):
+        if os.path.exists(directory):
+            shutil.rmtree(previous)
+        else:
+            os.rename(previous, directory)
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+
+    f = None
+    count = 0
+    try:
+        for pair in pairs:
+            if f is None:
+                f = open(os.path.join(staging, f"fine-tune-{stats.shards:05d}.jsonl"), "w", encoding="utf-8")
+                count = 0
+
+            f.write(json.dumps({"prompt": pair["prompt"], "completion": pair["completion"]}, ensure_ascii=False) + "\n")
+            count += 1
+            stats.written += 1
+
+            if count >= shard_size:
+                f.close()
+                f = None
+                stats.shards += 1
+
+        if f is not None:
+            f.close()
+            f = None
+            stats.shards += 1
+    except BaseException:
+        if f is not None:
+            f.close()
+        shutil.rmtree(staging)
+        raise
+
+    if os.path.exists(directory):
+        os.rename(directory, previous)
+    os.rename(staging, directory)
+    if os.path.exists(previous):
+        shutil.rmtree(previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build fine-tuning JSONL shards from saved conversations & the ASVS guide generator's completions.")
+    parser.add_argument("--transcripts", nargs="*", default=["transcripts"], help="transcript directories of `assist.py`")
+    parser.add_argument("--completions", nargs="*", default=[os.path.join("Projects", "ASVS", "cache", "completions.jsonl")],
+                        help="completion caches of the ASVS guide generator")
+    parser.add_argument("--output", default=os.path.join("data", "fine-tune"), help="directory the shards are written to")
+    parser.add_argument("--shard-size", type=int, default=1000, help="pairs per shard")
+    parser.add_argument("--min-tokens", type=int, default=16, help="leave out pairs with fewer (estimated) tokens")
+    parser.add_argument("--max-tokens", type=int, default=4096, help="leave out pairs with more (estimated) tokens")
+    args = parser.parse_args()
+
+    stats = DatasetStats()
+
+    def read_pairs() -> Iterator[Dict[str, str]]:
+        for directory in args.transcripts:
+            yield from read_transcript_pairs(directory, stats)
+        for path in args.completions:
+            yield from read_completion_pairs(path, stats)
+
+    # every stage is a generator, so only one pair is held at a time (plus a digest of each, to find duplicates)
+    pairs = deduplicate(filter_pairs(read_pairs(), stats, args.min_tokens, args.max_tokens), stats)
+    write_shards(pairs, args.output, stats, args.shard_size)
+
+    print(stats.report())
+
+if __name__ == "__main__":
+    main()
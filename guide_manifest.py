@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, Optional
+
+from atomic_writer import write_atomic
+
+
+def get_hash(*parts: Any) -> str:
+    """
+    Returns a stable hash of `parts`, which must be JSON serialisable.
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GuideManifest:
+    """
+    Records the hash of everything each generated file depends on (e.g. the requirements,
+    model & prompts), so a later run only regenerates the files whose hash has changed.
+
+    Entries are keyed by node (e.g. a chapter or section code) and saved to `path` after
+    every update, so an interrupted run keeps track of the files it finished.
+
+    A new manifest can start from the entries of `previous` (e.g. the manifest of the guide for
+    the last release), so whatever they record (e.g. the content each file was rendered from)
+    can be reused; their files aren't in this manifest's directory, so none of them are current.
+    """
+
+    def __init__(self, path: str, previous: Optional[str] = None, **meta):
+        self.path = path
+        self.meta = meta
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        self.carried_over = 0
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.nodes = json.load(f).get("nodes", {})
+        elif previous is not None and os.path.exists(previous):
+            with open(previous, encoding="utf-8") as f:
+                self.nodes = json.load(f).get("nodes", {})
+            self.carried_over = len(self.nodes)
+
+    def is_current(self, key: str, node_hash: str) -> bool:
+        """
+        Checks the node's file was generated from the same inputs, & still exists.
+        """
+        entry = self.nodes.get(key)
+        return entry is not None and entry["hash"] == node_hash and os.path.exists(os.path.join(os.path.dirname(self.path), entry["file"]))
+
+    def update(self, key: str, node_hash: Optional[str], file: str, **details) -> None:
+        """
+        Records the node's file as generated from `node_hash`, removing its previous file if it's moved.
+
+        Args:
+            key (str): The node, e.g. a chapter or section code.
+            node_hash (str): The hash of the node's inputs, or `None` if the file's incomplete, so it's never current.
+            file (str): The path of the node's file.
+            **details: Anything else to record, e.g. the content of the parts of the file that can be reused.
+        """
+        file = os.path.relpath(file, os.path.dirname(self.path))
+        previous = self.nodes.get(key)
+        if previous is not None and previous["file"] != file:
+            self._remove_file(previous["file"])
+
+        self.nodes[key] = {"hash": node_hash, "file": file, **details}
+        self.save()
+
+    def remove_stale(self, keys: Iterable[str]) -> int:
+        """
+        Removes the nodes that aren't in `keys`, and their files (unless a node in `keys` has been written to the same file).
+
+        Returns:
+            int: The number of nodes removed.
+        """
+        keys = set(keys)
+        stale = set(self.nodes) - keys
+        current_files = {self.nodes[key]["file"] for key in keys & set(self.nodes)}
+        for key in stale:
+            file = self.nodes.pop(key)["file"]
+            if file not in current_files:
+                self._remove_file(file)
+
+        if stale:
+            self.save()
+        return len(stale)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.nodes.get(key)
+
+    def _remove_file(self, file: str) -> None:
+        path = os.path.join(os.path.dirname(self.path), file)
+        if os.path.exists(path):
+            os.remove(path)
+
+        directory = os.path.dirname(path)
+        if directory != os.path.dirname(self.path) and os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+    def save(self) -> None:
+        write_atomic(self.path, json.dumps({**self.meta, "nodes": self.nodes}, indent=2, ensure_ascii=False).encode("utf-8"))
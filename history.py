@@ -0,0 +1,151 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from chat_client import ChatClient, estimate_tokens
+
+SUMMARY_PROMPT = "Summarise the conversation below as concisely as possible for your own later reference. " \
+                 "Keep any names, facts, decisions, preferences & open questions needed to continue it."
+
+
+def split_system_messages(messages: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+    """
+    Splits the leading system messages from the rest of the conversation.
+    """
+    index = 0
+    while index < len(messages) and messages[index]["role"] == "system":
+        index += 1
+    return messages[:index], messages[index:]
+
+
+def take_recent(messages: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    """
+    Returns the longest run of the most recent messages that fits in `max_tokens`, always including the last message.
+    """
+    total = 0
+    for index in range(len(messages) - 1, -1, -1):
+        total += estimate_tokens([messages[index]])
+        if total > max_tokens and index < len(messages) - 1:
+            return messages[index + 1:]
+    return messages
+
+
+class HistoryStrategy:
+    """
+    Decides which parts of the conversation are sent with each request.
+    """
+
+    def compact(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        return messages
+
+
+class SlidingWindow(HistoryStrategy):
+    """
+    Sends the system messages & the `max_messages` most recent messages.
+    """
+
+    def __init__(self, max_messages: int = 20):
+        self.max_messages = max_messages
+
+    def compact(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        system, conversation = split_system_messages(messages)
+        return system + conversation[-self.max_messages:]
+
+
+class Summarise(HistoryStrategy):
+    """
+    Folds older messages into a running summary once the unsummarised part of the conversation
+    grows beyond `max_tokens`, keeping roughly the most recent `keep_tokens` verbatim.
+
+    The summary is sent as a synthetic system message after the original system messages.
+    """
+
+    def __init__(self, client: ChatClient, model_id: str, max_tokens: int = 2000, keep_tokens: int = 1000):
+        self.client = client
+        self.model_id = model_id
+        self.max_tokens = max_tokens
+        self.keep_tokens = keep_tokens
+        self.summary: Optional[str] = None
+        self.summarised = 0
+
+    def summarise(self, messages: List[Dict[str, str]]) -> str:
+        transcript = "\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        if self.summary:
+            transcript = f"Summary of the earlier conversation: {self.summary}\n\n{transcript}"
+
+        response = self.client.create(
+            model=self.model_id,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            tags={"kind": "summary"}
+        )
+
+        return response['choices'][0]['message']['content'] # type: ignore
+
+    def compact(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        system, conversation = split_system_messages(messages)
+        pending = conversation[self.summarised:]
+
+        if estimate_tokens(pending) > self.max_tokens:
+            recent = take_recent(pending, self.keep_tokens)
+            older = pending[:len(pending) - len(recent)]
+            if older:
+                self.summary = self.summarise(older)
+                self.summarised += len(older)
+                pending = recent
+
+        if self.summary:
+            system = system + [{"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"}]
+
+        return system + pending
+
+
+class ConversationHistory:
+    """
+    Holds the full conversation, and builds the (compacted) messages to send with each request.
+
+    Args:
+        messages (List[Dict[str, str]]): The messages to start the conversation with, the leading system messages are always sent.
+        strategy (HistoryStrategy): How to compact the conversation [default: send everything].
+        max_request_tokens (int): Hard limit on the (estimated) tokens sent per request; the oldest non-system messages
+                                  are dropped until a request fits.
+    """
+
+    def __init__(self, messages: List[Dict[str, str]], strategy: Optional[HistoryStrategy] = None, max_request_tokens: Optional[int] = None):
+        self.messages = list(messages)
+        self.strategy = strategy or HistoryStrategy()
+        self.max_request_tokens = max_request_tokens
+
+    def append(self, role: str, content: str) -> None:
+        self.messages.append({"role": role, "content": content})
+
+    def pop(self) -> Dict[str, str]:
+        return self.messages.pop()
+
+    def get_request_messages(self) -> List[Dict[str, str]]:
+        messages = self.strategy.compact(self.messages)
+
+        if self.max_request_tokens:
+            system, conversation = split_system_messages(messages)
+            messages = system + take_recent(conversation, self.max_request_tokens - estimate_tokens(system))
+
+        return messages
+
+
+def get_history_strategy(config: Dict[str, Any], client: ChatClient, model_id: str) -> HistoryStrategy:
+    """
+    Creates the history strategy selected by `history_strategy` in the config.
+
+    Raises:
+        ValueError: If the strategy is unknown.
+    """
+    name = config.get("history_strategy", "all")
+
+    if name == "all":
+        return HistoryStrategy()
+    elif name == "window":
+        return SlidingWindow(config.get("history_window", 20))
+    elif name == "summarise":
+        return Summarise(client, model_id, config.get("summarise_after_tokens", 2000), config.get("summarise_keep_tokens", 1000))
+
+    raise ValueError(f"Unknown history_strategy '{name}', expected one of: all, window, summarise")
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from atomic_writer import write_atomic
+
+
+class HttpCache:
+    """
+    Downloads files over a pooled session, caching them on disk.
+
+    A cached response is used as is for `max_age` seconds, after which it's revalidated
+    with `If-None-Match` / `If-Modified-Since` so an unchanged file isn't downloaded
+    again. If the server can't be reached the cached response is used regardless.
+
+    Args:
+        directory (str): Where responses are cached.
+        timeout (float | Tuple[float, float]): Connect & read timeouts in seconds.
+        session (requests.Session): The session to send requests with [default: a new pooled session].
+    """
+
+    def __init__(self, directory: str, timeout: Union[float, Tuple[float, float]] = (10, 60), session: Optional[requests.Session] = None):
+        self.directory = directory
+        # a timeout from a JSON config is a list, but requests only accepts a tuple
+        self.timeout = tuple(timeout) if isinstance(timeout, list) else timeout
+        self.hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _get_paths(self, url: str) -> Tuple[str, str]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.json"), os.path.join(self.directory, f"{key}.body")
+
+    def _load(self, url: str) -> Tuple[Optional[Dict[str, Any]], Optional[bytes]]:
+        meta_path, body_path = self._get_paths(url)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, json.JSONDecodeError):
+            return None, None
+
+    def _save(self, url: str, response: requests.Response) -> None:
+        meta_path, body_path = self._get_paths(url)
+        meta = {
+            "url": url,
+            "fetched": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+        # write the body before the metadata, so the metadata never points at a partial body
+        write_atomic(body_path, response.content)
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def _touch(self, url: str, meta: Dict[str, Any]) -> None:
+        meta_path, _ = self._get_paths(url)
+        write_atomic(meta_path, json.dumps({**meta, "fetched": time.time()}).encode("utf-8"))
+
+    def get(self, url: str, max_age: Optional[float] = 0) -> bytes:
+        """
+        Returns the content at `url`, from the cache if it's fresh or unchanged.
+
+        Args:
+            url (str): The URL to GET.
+            max_age (float): Seconds a cached response is used without revalidating it, `None` to never revalidate (e.g. for immutable files).
+
+        Raises:
+            requests.RequestException: If the request fails & there's no cached response.
+        """
+        meta, body = self._load(url)
+
+        if meta is not None and body is not None:
+            if max_age is None or time.time() - meta["fetched"] < max_age:
+                self.hits += 1
+                return body
+
+        headers = {}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and meta is not None and body is not None:
+                self.revalidated += 1
+                self._touch(url, meta)
+                return body
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if body is None:
+                raise
+            print(f"Using cached {url}: {e}")
+            self.hits += 1
+            return body
+
+        self.downloads += 1
+        self._save(url, response)
+        return response.content
+
+    def fetch(self, url: str) -> bytes:
+        """
+        Returns the content at `url`, without caching it.
+
+        Raises:
+            requests.RequestException: If the request fails.
+        """
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        self.downloads += 1
+        return response.content
+
+    def get_json(self, url: str, max_age: Optional[float] = 0) -> Any:
+        return json.loads(self.get(url, max_age))
+
+    def close(self) -> None:
+        self.session.close()
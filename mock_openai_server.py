@@ -0,0 +1,329 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+def mock_completion(messages: List[Dict[str, str]]) -> str:
+    """
+    Returns a deterministic stand-in response for `messages`.
+    """
+    prompt = messages[-1]["content"] if messages else ""
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    # prompts that ask for a heading get one, so the responses pass the generator's validation
+    heading = f"## Mock heading {digest}\n\n" if "heading" in prompt.lower() else ""
+    return f"{heading}Mock response {digest} to: {prompt[:80]}"
+
+
+def count_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def count_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(4 + count_tokens(message.get("content") or "") for message in messages)
+
+
+def chat_completion(model: str, messages: List[Dict[str, str]], cached_tokens: int = 0) -> Dict[str, Any]:
+    content = mock_completion(messages)
+    prompt_tokens = count_prompt_tokens(messages)
+    completion_tokens = count_tokens(content)
+
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens,
+                  "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+    }
+
+
+class MockState:
+    """
+    The files, batches & settings shared by every request to the server.
+
+    Args:
+        models (List[str]): The model IDs to list.
+        latency (float): Seconds to wait before answering each chat completion.
+        batch_delay (float): Seconds a batch stays in progress before it completes.
+        asvs_files (List[str]): ASVS release JSON files (e.g. one per language) to serve as the assets of every GitHub release [optional].
+    """
+
+    def __init__(self, models: List[str], latency: float = 0.0, batch_delay: float = 1.0, asvs_files: Optional[List[str]] = None):
+        self.models = models
+        self.latency = latency
+        self.batch_delay = batch_delay
+        self.asvs_files = asvs_files or []
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.prefixes: set = set()
+        self.lock = threading.Lock()
+
+    def get_cached_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """
+        Simulates a prompt cache: returns the tokens in the longest run of leading messages that's been sent before,
+        and remembers every prefix of `messages`.
+        """
+        keys = [hashlib.sha256(json.dumps(messages[:length], sort_keys=True).encode("utf-8")).hexdigest()
+                for length in range(1, len(messages) + 1)]
+
+        with self.lock:
+            cached = 0
+            for length, key in enumerate(keys, start=1):
+                if key in self.prefixes:
+                    cached = length
+            self.prefixes.update(keys)
+
+        return count_prompt_tokens(messages[:cached])
+
+    def complete(self, model: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        return chat_completion(model, messages, self.get_cached_tokens(messages))
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-{uuid.uuid4().hex}"
+        with self.lock:
+            self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "filename": filename, "purpose": purpose,
+                "created_at": int(time.time())}
+
+    def create_batch(self, input_file_id: str, endpoint: str, completion_window: str) -> Dict[str, Any]:
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "in_progress",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+
+        with self.lock:
+            self.batches[batch["id"]] = batch
+
+        threading.Thread(target=self.run_batch, args=(batch["id"],), daemon=True).start()
+        return batch
+
+    def run_batch(self, batch_id: str) -> None:
+        with self.lock:
+            batch = self.batches[batch_id]
+            lines = self.files[batch["input_file_id"]].decode("utf-8").splitlines()
+
+        requests = [json.loads(line) for line in lines if line.strip()]
+        batch["request_counts"]["total"] = len(requests)
+        time.sleep(self.batch_delay)
+
+        output = []
+        for request in requests:
+            body = request["body"]
+            response = self.complete(body["model"], body["messages"])
+            output.append({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": response},
+                "error": None,
+            })
+
+        content = "".join(json.dumps(entry) + "\n" for entry in output).encode("utf-8")
+        output_file = self.add_file(content, f"{batch_id}_output.jsonl", "batch_output")
+
+        with self.lock:
+            batch["request_counts"]["completed"] = len(output)
+            batch["output_file_id"] = output_file["id"]
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Serves the parts of the OpenAI API the scripts use: models, chat completions (incl. streaming), files & batches.
+    """
+
+    state: MockState
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def send_json(self, body: Any, status: int = 200) -> None:
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_error_json(self, status: int, message: str) -> None:
+        self.send_json({"error": {"message": message, "type": "invalid_request_error"}}, status)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send_cacheable(self, content: bytes, content_type: str) -> None:
+        """
+        Sends `content` with an ETag, or a 304 if the client already has it.
+        """
+        etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_asvs_release(self, path: str) -> bool:
+        """
+        Serves `asvs_files` like a GitHub release (the latest, or any tag) & its assets, returning whether `path` was one of them.
+        """
+        files = {os.path.basename(file): file for file in self.state.asvs_files}
+        if not files:
+            return False
+
+        match = re.fullmatch(r"/repos/OWASP/ASVS/releases/tags/([\w.-]+)", path)
+        if path == "/repos/OWASP/ASVS/releases/latest" or match:
+            release = {"tag_name": match.group(1) if match else "mock",
+                       "assets": [{"name": name, "browser_download_url": f"http://{self.headers['Host']}/download/{name}"} for name in files]}
+            self.send_cacheable(json.dumps(release).encode("utf-8"), "application/json")
+        elif path.startswith("/download/") and path[len("/download/"):] in files:
+            with open(files[path[len("/download/"):]], "rb") as f:
+                self.send_cacheable(f.read(), "application/octet-stream")
+        else:
+            return False
+        return True
+
+    def get_path(self) -> str:
+        # accept paths with or without the `/v1` prefix
+        return re.sub(r"^/v1(?=/)", "", self.path.split("?")[0])
+
+    def do_GET(self) -> None:
+        path = self.get_path()
+
+        if path == "/models":
+            self.send_json({"object": "list", "data": [{"id": model, "object": "model", "owned_by": "mock"} for model in self.state.models]})
+        elif match := re.fullmatch(r"/batches/([\w-]+)", path):
+            batch = self.state.batches.get(match.group(1))
+            if batch is None:
+                self.send_error_json(404, "No such batch")
+                return
+            with self.state.lock:
+                self.send_json(batch)
+        elif match := re.fullmatch(r"/files/([\w-]+)/content", path):
+            content = self.state.files.get(match.group(1))
+            if content is None:
+                self.send_error_json(404, "No such file")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        elif not self.send_asvs_release(path):
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_POST(self) -> None:
+        path = self.get_path()
+        body = self.read_body()
+
+        if path == "/chat/completions":
+            request = json.loads(body)
+            time.sleep(self.state.latency)
+            response = self.state.complete(request["model"], request["messages"])
+            if request.get("stream"):
+                self.send_stream(response)
+            else:
+                self.send_json(response)
+        elif path == "/files":
+            upload = self.parse_upload(body)
+            if upload is None:
+                self.send_error_json(400, "Expected a multipart upload with a `file` field")
+                return
+            self.send_json(self.state.add_file(*upload))
+        elif path == "/batches":
+            request = json.loads(body)
+            if request.get("input_file_id") not in self.state.files:
+                self.send_error_json(400, "No such input file")
+                return
+            self.send_json(self.state.create_batch(request["input_file_id"], request.get("endpoint", "/v1/chat/completions"),
+                                                   request.get("completion_window", "24h")))
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}")
+
+    def parse_upload(self, body: bytes) -> Optional[tuple]:
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=HTTP).parsebytes(header + body)
+        if not message.is_multipart():
+            return None
+
+        content, filename, purpose = None, "upload.jsonl", ""
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                content = part.get_payload(decode=True)
+                filename = part.get_filename() or filename
+            elif name == "purpose":
+                purpose = part.get_payload(decode=True).decode("utf-8")
+
+        return (content, filename, purpose) if content is not None else None
+
+    def send_stream(self, response: Dict[str, Any]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.close_connection = True
+
+        content = response["choices"][0]["message"]["content"]
+        pieces = [{"role": "assistant"}] + [{"content": piece} for piece in re.findall(r"\S+\s*", content)]
+
+        for index, delta in enumerate(pieces + [{}]):
+            chunk = {
+                "id": response["id"],
+                "object": "chat.completion.chunk",
+                "created": response["created"],
+                "model": response["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if index == len(pieces) else None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the OpenAI API, for testing & benchmarking without the network.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--models", nargs="+", default=["gpt-3.5-turbo", "gpt-4"], help="model IDs to list")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering each chat completion")
+    parser.add_argument("--batch-delay", type=float, default=1.0, help="seconds each batch stays in progress")
+    parser.add_argument("--asvs-file", nargs="+", help="ASVS release JSON files to serve as the assets of /repos/OWASP/ASVS/releases/latest (& /tags/<tag>)")
+    args = parser.parse_args()
+
+    MockHandler.state = MockState(args.models, args.latency, args.batch_delay, args.asvs_file)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+
+    print(f"Mock OpenAI API listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
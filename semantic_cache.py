@@ -0,0 +1,290 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from operator import mul
+from typing import Any, Dict, List, Optional, Tuple
+
+from atomic_writer import write_atomic
+
+# the format of the saved index, an index in another format is discarded
+INDEX_VERSION = 2
+
+
+def normalise(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else vector
+
+
+def encode(vector: "array[float]") -> str:
+    return base64.b64encode(vector.tobytes()).decode("ascii")
+
+
+class Embedder:
+    """
+    Turns text into a vector, so similar text can be found by cosine similarity.
+    """
+
+    @property
+    def name(self) -> str:
+        """
+        Identifies the embedder's vectors, which can't be compared with another embedder's.
+        """
+        raise NotImplementedError
+
+    def embed(self, text: str) -> List[float]:
+        """
+        Returns the unit length vector of `text`.
+        """
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """
+    Hashes the words & pairs of words in the text into `dimensions` buckets.
+
+    Needs nothing beyond the standard library & is near instant, but only matches text that
+    uses (mostly) the same words; e.g. a question asked again with different punctuation,
+    casing or a word or two changed.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    @property
+    def name(self) -> str:
+        return f"hashing-{self.dimensions}"
+
+    def embed(self, text: str) -> List[float]:
+        words = re.findall(r"\w+", text.lower())
+        vector = [0.0] * self.dimensions
+        for feature in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=5).digest()
+            # the sign spreads collisions out, rather than them always adding up
+            vector[int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0 if digest[4] & 1 else -1.0
+        return normalise(vector)
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """
+    Embeds text with a local [sentence-transformers](https://www.sbert.net) model, which also matches
+    questions that are worded differently. The model is downloaded on first use, then runs offline.
+
+    Raises:
+        ValueError: If `sentence-transformers` isn't installed.
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ValueError("The sentence_transformers embedder needs `pip install sentence-transformers`") from e
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    @property
+    def name(self) -> str:
+        return f"sentence_transformers-{self.model_name}"
+
+    def embed(self, text: str) -> List[float]:
+        return [float(value) for value in self.model.encode(text, normalize_embeddings=True)]
+
+
+def get_embedder(config: Dict[str, Any]) -> Embedder:
+    """
+    Creates the embedder selected by `semantic_cache_embedder` in the config.
+
+    Raises:
+        ValueError: If the embedder is unknown, or its dependencies aren't installed.
+    """
+    name = config.get("semantic_cache_embedder", "hashing")
+
+    if name == "hashing":
+        return HashingEmbedder()
+    elif name == "sentence_transformers":
+        return SentenceTransformerEmbedder(config.get("semantic_cache_model", "all-MiniLM-L6-v2"))
+
+    raise ValueError(f"Unknown semantic cache embedder '{name}', expected one of: hashing, sentence_transformers")
+
+
+class SemanticCache:
+    """
+    Answers prompts that are similar enough to one that's already been answered, without a request.
+
+    Each response is stored with the embedding of its prompt & the embedding of the `context_messages`
+    before it, and a prompt only matches if both its own & its context's similarity reach the threshold,
+    so a follow-up like "tell me more" only matches in a similar conversation. Responses are only
+    matched for the same model & system messages (i.e. persona). Entries
+    expire after `ttl` seconds, and the least recently used are evicted beyond `max_entries`.
+
+    The index is kept in memory & searched by brute force, which takes a few milliseconds for a
+    thousand entries, and saved to `path` (replacing it in one go) after every change.
+
+    Args:
+        path (str): The JSON file the index is saved to.
+        embedder (Embedder): What embeds the prompts.
+        threshold (float): The minimum cosine similarity of a match, from 0 to 1.
+        max_entries (int): The number of entries to keep.
+        ttl (float): Seconds an entry is kept for.
+        context_messages (int): The number of messages before each prompt that must be similar too.
+    """
+
+    def __init__(self, path: str, embedder: Embedder, threshold: float = 0.9, max_entries: int = 1000, ttl: float = 604800,
+                 context_messages: int = 2):
+        self.path = path
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.context_messages = context_messages
+        self.hits = 0
+        self.misses = 0
+        self.lookup_time = 0.0
+        self._entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    index = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                index = {}
+            # vectors from another embedder can't be compared with this one's
+            if index.get("embedder") == embedder.name and index.get("version") == INDEX_VERSION:
+                for entry in index.get("entries", []):
+                    entry["vector"] = array("f", base64.b64decode(entry["vector"]))
+                    entry["context"] = array("f", base64.b64decode(entry["context"])) if entry["context"] is not None else None
+                    self._entries.append(entry)
+                self._evict(time.time())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_scope(self, model_id: str, messages: List[Dict[str, str]]) -> str:
+        system = [message["content"] for message in messages if message["role"] == "system"]
+        return hashlib.sha256(json.dumps([model_id, system], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get_vectors(self, messages: List[Dict[str, str]]) -> "Tuple[array[float], Optional[array[float]]]":
+        """
+        Returns the vectors of the prompt & of the messages before it (or `None` if there aren't any, or they're not compared).
+        """
+        conversation = [message for message in messages if message["role"] != "system"]
+        prompt = array("f", self.embedder.embed(conversation[-1]["content"] if conversation else ""))
+        context = conversation[-1 - self.context_messages:-1] if self.context_messages else []
+        if not context:
+            return prompt, None
+        return prompt, array("f", self.embedder.embed("\n".join(message["content"] for message in context)))
+
+    def get_similarity(self, vector: "array[float]", context: "Optional[array[float]]", entry: Dict[str, Any]) -> Optional[float]:
+        """
+        Returns the similarity of the prompt to `entry`'s, if both the prompts & their contexts are similar enough.
+        """
+        # a question that starts a conversation never matches a follow-up, or vice versa
+        if (context is None) != (entry["context"] is None):
+            return None
+        if context is not None and sum(map(mul, context, entry["context"])) < self.threshold:
+            return None
+        similarity = sum(map(mul, vector, entry["vector"]))
+        return similarity if similarity >= self.threshold else None
+
+    def get(self, model_id: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Returns the response to the most similar prompt to the last of `messages`, if it's similar enough.
+
+        Args:
+            model_id (str): The model the request would be sent to.
+            messages (List[Dict[str, str]]): The conversation so far, ending with the prompt.
+        """
+        started = time.monotonic()
+        scope = self.get_scope(model_id, messages)
+        vector, context = self.get_vectors(messages)
+        now = time.time()
+
+        with self._lock:
+            best, best_similarity = None, self.threshold
+            for entry in self._entries:
+                if entry["scope"] != scope or now - entry["created"] > self.ttl:
+                    continue
+                similarity = self.get_similarity(vector, context, entry)
+                if similarity is not None and similarity >= best_similarity:
+                    best, best_similarity = entry, similarity
+
+            self.lookup_time += time.monotonic() - started
+            if best is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            best["used"] = now
+            return best["content"]
+
+    def put(self, model_id: str, messages: List[Dict[str, str]], content: str) -> None:
+        """
+        Stores `content` as the response to the last of `messages`.
+        """
+        now = time.time()
+        vector, context = self.get_vectors(messages)
+        entry = {
+            "scope": self.get_scope(model_id, messages),
+            "vector": vector,
+            "context": context,
+            "model": model_id,
+            "prompt": messages[-1]["content"] if messages else "",
+            "content": content,
+            "created": now,
+            "used": now,
+        }
+
+        with self._lock:
+            self._entries.append(entry)
+            self._evict(now)
+            self._save()
+
+    def _evict(self, now: float) -> None:
+        self._entries = [entry for entry in self._entries if now - entry["created"] <= self.ttl]
+        if len(self._entries) > self.max_entries:
+            self._entries.sort(key=lambda entry: entry["used"])
+            self._entries = self._entries[-self.max_entries:]
+
+    def _save(self) -> None:
+        entries = [{**entry, "vector": encode(entry["vector"]), "context": encode(entry["context"]) if entry["context"] is not None else None}
+                   for entry in self._entries]
+        index = {"version": INDEX_VERSION, "embedder": self.embedder.name, "entries": entries}
+        write_atomic(self.path, json.dumps(index, ensure_ascii=False).encode("utf-8"))
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses
+        ratio = self.hits / lookups if lookups else 0.0
+        average = self.lookup_time / lookups * 1000 if lookups else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({ratio:.0%} hit ratio), {len(self)} entries, {average:.1f}ms per lookup"
+
+    def close(self) -> None:
+        # keep when each entry was last used, for eviction
+        with self._lock:
+            if self._entries:
+                self._save()
+
+
+def get_semantic_cache(config: Dict[str, Any]) -> Optional[SemanticCache]:
+    """
+    Creates the semantic cache at `semantic_cache` in the config, if it's set.
+
+    Raises:
+        ValueError: If the embedder is unknown, or its dependencies aren't installed.
+    """
+    path = config.get("semantic_cache")
+    if not path:
+        return None
+
+    return SemanticCache(path, get_embedder(config), config.get("semantic_cache_threshold", 0.9), config.get("semantic_cache_max_entries", 1000),
+                         config.get("semantic_cache_ttl", 604800), config.get("semantic_cache_context", 2))
@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Returns the nearest-rank `percent` percentile of `values`, or 0 if there aren't any.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+class Telemetry:
+    """
+    Records every model call to a JSONL trace & summarises them at the end of a run.
+
+    Each record has the call's `tags` (e.g. which chapter, section or requirement it's
+    for), wall time, time to first token, token usage, retries & where the response
+    came from (`api`, `batch`, `cache`, or `shared` with an identical request in flight).
+
+    Args:
+        path (str): The JSONL file to append records to [optional, default: only keep them in memory].
+        prices (Dict[str, Dict[str, float]]): The price per 1K `prompt`, `cached_prompt` & `completion` tokens, by model [optional].
+    """
+
+    def __init__(self, path: Optional[str] = None, prices: Optional[Dict[str, Dict[str, float]]] = None):
+        self.path = path
+        self.prices = prices or {}
+        self.records: List[Dict[str, Any]] = []
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = None
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, model: str, source: str, wall: float, ttft: Optional[float] = None, usage: Optional[Dict[str, Any]] = None,
+               retries: int = 0, wait: float = 0.0, error: Optional[str] = None, tags: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Records a model call.
+
+        Args:
+            model (str): The model the call was sent to.
+            source (str): Where the response came from: `api`, `batch`, `cache` or `shared`.
+            wall (float): Seconds from the call being made to the response being complete.
+            ttft (float): Seconds to the first token of the response [default: `wall`].
+            usage (Dict[str, Any]): The token usage of the response [optional].
+            retries (int): The number of times the request was retried.
+            wait (float): Seconds spent waiting on the rate limits.
+            error (str): The error the call failed with, or `cancelled` if it was closed before it was complete [optional].
+            tags (Dict[str, Any]): What the call was for, e.g. the chapter, section & requirement [optional].
+        """
+        usage = usage or {}
+        details = usage.get("prompt_tokens_details") or {}
+        record = {
+            "time": time.time(),
+            "model": model,
+            "source": source,
+            "wall": round(wall, 4),
+            "ttft": round(ttft if ttft is not None else wall, 4),
+            "wait": round(wait, 4),
+            "prompt_tokens": usage.get("prompt_tokens") or 0,
+            "cached_tokens": details.get("cached_tokens") or 0,
+            "completion_tokens": usage.get("completion_tokens") or 0,
+            "retries": retries,
+            "error": error,
+            **(tags or {}),
+        }
+        record["cost"] = self.get_cost(record)
+
+        with self._lock:
+            self.records.append(record)
+            if self._file is not None:
+                self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._file.flush()
+
+    def get_cost(self, record: Dict[str, Any]) -> Optional[float]:
+        price = self.prices.get(record["model"])
+        if price is None or record["source"] in ("cache", "shared"):
+            return None if price is None else 0.0
+
+        uncached = record["prompt_tokens"] - record["cached_tokens"]
+        cost = uncached * price.get("prompt", 0) + record["cached_tokens"] * price.get("cached_prompt", price.get("prompt", 0)) \
+            + record["completion_tokens"] * price.get("completion", 0)
+        return round(cost / 1000, 6)
+
+    def report(self, group_by: Optional[str] = None) -> str:
+        """
+        Summarises the calls: latency percentiles, throughput, retries & cache hits, plus the
+        tokens & cost of each kind of call and, if set, of each value of the `group_by` tag.
+        """
+        with self._lock:
+            records = list(self.records)
+
+        elapsed = time.monotonic() - self.started
+        requests = [record for record in records if record["source"] not in ("cache", "shared") and record["error"] is None]
+        walls = [record["wall"] for record in requests]
+        ttfts = [record["ttft"] for record in requests]
+        completion_tokens = sum(record["completion_tokens"] for record in requests)
+        rates = [record["completion_tokens"] / record["wall"] for record in requests if record["wall"] > 0]
+
+        lines = [
+            f"{len(records)} calls in {elapsed:.1f}s: {len(requests)} requests, "
+            f"{sum(record['source'] == 'cache' for record in records)} cache hits, "
+            f"{sum(record['source'] == 'shared' for record in records)} shared, "
+            f"{sum(record['retries'] for record in records)} retries, "
+            f"{sum(record['error'] not in (None, 'cancelled') for record in records)} errors, "
+            f"{sum(record['error'] == 'cancelled' for record in records)} cancelled",
+            f"Latency: p50 {percentile(walls, 50):.2f}s, p95 {percentile(walls, 95):.2f}s, "
+            f"time to first token p50 {percentile(ttfts, 50):.2f}s, p95 {percentile(ttfts, 95):.2f}s, "
+            f"rate limit wait {sum(record['wait'] for record in records):.1f}s",
+            f"Throughput: {completion_tokens / elapsed if elapsed > 0 else 0:.1f} tokens/s overall, "
+            f"p50 {percentile(rates, 50):.1f} tokens/s per request",
+        ]
+
+        for tag in ("kind", group_by):
+            if tag is None:
+                continue
+            groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+            for record in records:
+                if record.get(tag) is not None:
+                    groups[str(record[tag])].append(record)
+            for name, group in groups.items():
+                lines.append(f"  {tag} {name}: {self.summarise(group)}")
+
+        return "\n".join(lines)
+
+    def summarise(self, records: List[Dict[str, Any]]) -> str:
+        tokens = sum(record["prompt_tokens"] + record["completion_tokens"] for record in records)
+        costs = [record["cost"] for record in records if record["cost"] is not None]
+        summary = f"{len(records)} calls, {tokens} tokens ({tokens / len(records):.0f} per call), " \
+                  f"p50 {percentile([record['wall'] for record in records], 50):.2f}s"
+        if costs:
+            summary += f", ${sum(costs):.4f} (${sum(costs) / len(records):.4f} per call)"
+        return summary
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,125 @@
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def new_session_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+class TranscriptStore:
+    """
+    An append-only store of conversations.
+
+    Messages from every session are appended to `log.jsonl` as they happen, and the
+    byte offset & length of each is appended to the sidecar `index.jsonl`, along with
+    each session's metadata (name, system name, model, title, ...). Opening the store
+    only reads the index, and loading a session only reads that session's messages.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.log_path = os.path.join(directory, "log.jsonl")
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self._offsets: Dict[str, List[Tuple[int, int]]] = {}
+        self._meta: Dict[str, Dict[str, Any]] = {}
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    session_id = entry["session"]
+                    if "meta" in entry:
+                        self._meta.setdefault(session_id, {}).update(entry["meta"])
+                    else:
+                        self._offsets.setdefault(session_id, []).append((entry["offset"], entry["length"]))
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._meta
+
+    def _write_index(self, entry: Dict[str, Any]) -> None:
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _update_meta(self, session_id: str, **meta) -> None:
+        self._meta.setdefault(session_id, {}).update(meta)
+        self._write_index({"session": session_id, "meta": meta})
+
+    def start(self, session_id: Optional[str] = None, **meta) -> str:
+        """
+        Starts a new session.
+
+        Args:
+            session_id (str): The ID or name of the session [default: a new timestamped ID].
+            **meta: Any metadata to store with the session, e.g. the system name & model used.
+
+        Returns:
+            str: The ID of the session.
+        """
+        session_id = session_id or new_session_id()
+        self._update_meta(session_id, created=datetime.now(timezone.utc).isoformat(), **meta)
+        return session_id
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        """
+        Appends a message to a session.
+        """
+        line = (json.dumps({"session": session_id, "role": role, "content": content}, ensure_ascii=False) + "\n").encode("utf-8")
+
+        with open(self.log_path, "ab") as f:
+            offset = f.tell()
+            f.write(line)
+
+        self._offsets.setdefault(session_id, []).append((offset, len(line)))
+        self._write_index({"session": session_id, "offset": offset, "length": len(line)})
+
+        if role == "user" and "title" not in self._meta.get(session_id, {}):
+            self._update_meta(session_id, title=content[:80])
+
+    def load(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        Returns the messages of a session, in order.
+
+        Raises:
+            KeyError: If the session doesn't exist.
+        """
+        if session_id not in self._meta:
+            raise KeyError(session_id)
+
+        messages = []
+        offsets = self._offsets.get(session_id, [])
+        if offsets:
+            with open(self.log_path, "rb") as f:
+                for offset, length in offsets:
+                    f.seek(offset)
+                    entry = json.loads(f.read(length))
+                    messages.append({"role": entry["role"], "content": entry["content"]})
+
+        return messages
+
+    def get_meta(self, session_id: str) -> Dict[str, Any]:
+        return self._meta[session_id]
+
+    def sessions(self) -> List[Dict[str, Any]]:
+        """
+        Returns the metadata of every session, most recent first, each with its `session` ID & `messages` count.
+        """
+        sessions = [{"session": session_id, "messages": len(self._offsets.get(session_id, [])), **meta}
+                    for session_id, meta in self._meta.items()]
+        return sorted(sessions, key=lambda session: session.get("created", ""), reverse=True)
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Returns the sessions whose ID or metadata (e.g. title) contain `query`, ignoring case.
+        """
+        query = query.lower()
+        return [session for session in self.sessions()
+                if any(query in str(value).lower() for value in session.values())]
@@ -0,0 +1,137 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+REFUSALS = [
+    "I'm sorry, but as an AI language model",
+    "As an AI language model",
+    "I'm sorry, but I can't",
+    "I'm sorry, but I cannot",
+    "I cannot assist with",
+    "I can't assist with",
+]
+
+
+def add_note(prompt: str, note: str) -> str:
+    # a prompt that's failed the same way more than once only needs the note once
+    return prompt if note in prompt else f"{prompt}\n{note}"
+
+
+class ResponseValidator:
+    """
+    Checks a response, and says how to ask again if it fails.
+    """
+
+    name = "response"
+
+    def applies(self, tags: Dict[str, Any]) -> bool:
+        """
+        Returns whether the validator checks the response to a prompt with these `tags` (e.g. its `kind` & `part`).
+        """
+        return True
+
+    def check(self, content: str, finish_reason: Optional[str] = None) -> bool:
+        """
+        Returns whether the response passes.
+
+        Args:
+            content (str): The response content.
+            finish_reason (str): Why the model stopped, e.g. `stop` or `length` [optional, e.g. if the response was cached].
+        """
+        raise NotImplementedError
+
+    def adjust(self, prompt: str, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """
+        Returns the prompt & request parameters (e.g. `temperature`) to ask again with, after a response failed.
+        """
+        return prompt, params
+
+
+class RefusalValidator(ResponseValidator):
+    """
+    Fails responses that start with a refusal, and asks again with a higher temperature.
+    """
+
+    name = "refusal"
+
+    def __init__(self, refusals: Optional[List[str]] = None, temperature_step: float = 0.3, max_temperature: float = 1.6):
+        self.refusals = [refusal.lower() for refusal in refusals or REFUSALS]
+        self.temperature_step = temperature_step
+        self.max_temperature = max_temperature
+
+    def check(self, content: str, finish_reason: Optional[str] = None) -> bool:
+        # only the start is checked, so a guide that quotes a refusal (e.g. from a chatbot under test) passes
+        start = content.lstrip()[:200].lower()
+        return not any(refusal in start for refusal in self.refusals)
+
+    def adjust(self, prompt: str, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        temperature = min(self.max_temperature, params.get("temperature", 1.0) + self.temperature_step)
+        return prompt, {**params, "temperature": temperature}
+
+
+class TruncationValidator(ResponseValidator):
+    """
+    Fails responses cut off by the token limit, and asks again with double the limit (if one's set), or else for a shorter response.
+    """
+
+    name = "truncated"
+
+    def check(self, content: str, finish_reason: Optional[str] = None) -> bool:
+        return finish_reason != "length"
+
+    def adjust(self, prompt: str, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        if params.get("max_tokens"):
+            return prompt, {**params, "max_tokens": params["max_tokens"] * 2}
+        return add_note(prompt, "Keep your response concise, so it's complete."), params
+
+
+class HeadingValidator(ResponseValidator):
+    """
+    Fails responses without a Markdown heading of `level` (e.g. `## ...`), and asks again with a reminder to include one.
+
+    Only checks the responses to prompts whose `part` tag is in `parts`, i.e. those that ask for a heading.
+    """
+
+    name = "missing heading"
+
+    def __init__(self, level: int = 2, parts: Tuple[str, ...] = ("prereq",)):
+        self.level = level
+        self.parts = parts
+        self.pattern = re.compile(rf"^\s*#{{{level}}}\s+\S", re.MULTILINE)
+
+    def applies(self, tags: Dict[str, Any]) -> bool:
+        return tags.get("part") in self.parts
+
+    def check(self, content: str, finish_reason: Optional[str] = None) -> bool:
+        return self.pattern.search(content) is not None
+
+    def adjust(self, prompt: str, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        return add_note(prompt, f"Your response must include a Markdown heading starting with `{'#' * self.level} `."), params
+
+
+def validate(validators: List[ResponseValidator], content: str, finish_reason: Optional[str] = None) -> List[ResponseValidator]:
+    """
+    Returns the validators the response fails.
+    """
+    return [validator for validator in validators if not validator.check(content, finish_reason)]
+
+
+VALIDATORS = {
+    "refusal": RefusalValidator,
+    "truncation": TruncationValidator,
+    "headings": HeadingValidator,
+}
+
+
+def get_validators(config: Dict[str, Any]) -> List[ResponseValidator]:
+    """
+    Creates the validators named in `validators` in the config [default: all of them].
+
+    Raises:
+        ValueError: If a validator is unknown.
+    """
+    validators = []
+    for name in config.get("validators", list(VALIDATORS)):
+        if name not in VALIDATORS:
+            raise ValueError(f"Unknown validator '{name}', expected any of: {', '.join(VALIDATORS)}")
+        validators.append(VALIDATORS[name]())
+    return validators